@@ -1,22 +1,135 @@
 import numpy as np
 import sounddevice as sd
 import math
+import threading
+import time
+from collections import deque
+
+import pipeline
 
 C_NATURAL = 261.63
+SAMPLE_RATE = 44100
+BLOCK_SIZE = 256  # samples per callback, ~6 ms at 44.1 kHz
+
+
+class ToneSynth:
+    """Continuous sine oscillator on a persistent output stream.
+
+    The stream's callback renders every block from the current frequency and
+    volume, so changing them is just setting two numbers: no arrays are
+    allocated and nothing waits for a tone to finish. The phase carries over
+    between blocks and the frequency and volume glide across a block, so
+    changes don't click.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, block_size=BLOCK_SIZE):
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        self.frequency = C_NATURAL  # target parameters, set by set()
+        self.volume = 0.0
+        self.off_time = None        # stream time to fall silent, or None
+        self._frequency = C_NATURAL  # parameters the last block ended on
+        self._volume = 0.0
+        self._phase = 0.0
+        self._pending = None  # stream time of a set() not heard yet
+        self.latencies = deque(maxlen=100)  # set() -> at the DAC, seconds
+        # Work buffers, the callback never allocates
+        self._ramp = np.arange(1, block_size + 1, dtype=np.float64) / block_size
+        self._buffer = np.empty(block_size, dtype=np.float64)
+        self._gain = np.empty(block_size, dtype=np.float64)
+        self.stream = None
+
+    def start(self):
+        self.stream = sd.OutputStream(samplerate=self.sample_rate, channels=1,
+                                      dtype='float32',
+                                      blocksize=self.block_size,
+                                      latency='low', callback=self._callback)
+        self.stream.start()
+        return self
+
+    def set(self, frequency, volume=0.5, duration=None):
+        """Glide to <frequency> Hz at <volume>, silent again after
+        <duration> seconds (None to keep sounding)"""
+        now = self.stream.time if self.stream is not None else 0.0
+        with self.lock:
+            self.frequency = frequency
+            self.volume = volume
+            self.off_time = None if duration is None else now + duration
+            self._pending = now
+
+    def silence(self):
+        with self.lock:
+            self.volume = 0.0
+            self.off_time = None
+
+    def _callback(self, outdata, frames, time_info, status):
+        with self.lock:
+            frequency, volume = self.frequency, self.volume
+            if self.off_time is not None and \
+                    time_info.outputBufferDacTime >= self.off_time:
+                volume = self.volume = 0.0
+                self.off_time = None
+            pending, self._pending = self._pending, None
+        if pending is not None:
+            self.latencies.append(time_info.outputBufferDacTime - pending)
+
+        if frames != self.block_size:  # the host may ask for odd sizes
+            ramp = np.arange(1, frames + 1, dtype=np.float64) / frames
+            buffer, gain = np.empty(frames), np.empty(frames)
+        else:
+            ramp, buffer, gain = self._ramp, self._buffer, self._gain
+
+        # Phase increment per sample, gliding to the new frequency
+        step = 2 * math.pi / self.sample_rate
+        np.multiply(ramp, (frequency - self._frequency) * step, out=buffer)
+        buffer += self._frequency * step
+        np.cumsum(buffer, out=buffer)
+        buffer += self._phase
+        self._phase = buffer[-1] % (2 * math.pi)
+        np.sin(buffer, out=buffer)
+
+        np.multiply(ramp, volume - self._volume, out=gain)
+        gain += self._volume
+        buffer *= gain
+        outdata[:, 0] = buffer
+
+        self._frequency, self._volume = frequency, volume
+
+    def latency_ms(self):
+        """Mean time from set() until the change is at the DAC"""
+        if not self.latencies:
+            return None
+        return 1000 * sum(self.latencies) / len(self.latencies)
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+
+
+_synth = None
+_synth_lock = threading.Lock()
+
+def get_synth():
+    """Shared synth, the output stream is only opened once"""
+    global _synth
+    with _synth_lock:  # the feedback and audio input threads both play
+        if _synth is None:
+            _synth = ToneSynth().start()
+    return _synth
 
 def play(frequency=C_NATURAL, duration=1, volume=0.5):
     """
     <frequency>:    frequency in Hz
     <duration>:     duration in seconds
     <volume>:       volume from 0.0 to 1.0
+
+    Blocks for <duration>, for sequences of notes.
     """
-    # Calculate the time axis
-    t = np.linspace(0, duration, int(duration * 44100), False)
-    
-    # Generate a sine wave for the given frequency (beep)
-    sine_wave = volume * np.sin(2 * np.pi * frequency * t)
-    sd.play(sine_wave)
-    sd.wait()
+    get_synth().set(frequency, volume, duration)
+    time.sleep(duration)
 
 def calibrated_sound() -> None:
     note = 4 * C_NATURAL
@@ -26,8 +139,85 @@ def calibrated_sound() -> None:
     # Wait 1 second
     play(0, 1, 0)
 
-def play_distance(distance) -> None:
-    play((3 * math.exp(-((0.007 * distance) ** 2)) + 1) * C_NATURAL, 0.1, 0.5)
+def distance_frequency(distance):
+    return (3 * math.exp(-((0.007 * distance) ** 2)) + 1) * C_NATURAL
+
+def play_distance(distance, duration=0.1) -> None:
+    """Sound the tone for <distance> for <duration> seconds, returns at once"""
+    get_synth().set(distance_frequency(distance), 0.5, duration)
+
+def beep_interval(distance, min_interval=0.1, max_interval=0.6):
+    """Seconds between beeps, shorter as the limb gets closer to the hold"""
+    closeness = math.exp(-((0.007 * distance) ** 2))  # same curve as the pitch
+    return max_interval - (max_interval - min_interval) * closeness
+
+
+class FeedbackScheduler:
+    """Beeps the latest distance on its own monotonic clock.
+
+    The vision side puts every distance it measures in a
+    pipeline.LatestValue, at whatever rate it runs. This takes the newest
+    one, and beeps at a rate set by the distance, so the feedback sounds
+    the same on a slow or a fast machine.
+    """
+
+    def __init__(self, channel, min_interval=0.1, max_interval=0.6,
+                 beep_length=0.08, max_age=0.5):
+        """
+        <channel>:      pipeline.LatestValue of (distance, timestamp)
+        <min_interval>: seconds between beeps on the hold
+        <max_interval>: seconds between beeps far from it
+        <beep_length>:  seconds each beep sounds, at most
+        <max_age>:      distances older than this aren't played
+        """
+        self.channel = channel
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.beep_length = beep_length
+        self.max_age = max_age
+        self.beeps = 0
+        self.ages = deque(maxlen=100)  # distance age at each beep, seconds
+        self.intervals = deque(maxlen=100)
+
+    def interval(self, distance):
+        return beep_interval(distance, self.min_interval, self.max_interval)
+
+    def run(self):
+        latest = None  # (distance, timestamp)
+        last_beep = next_beep = time.monotonic()
+        while True:
+            item = self.channel.get(
+                timeout=max(0.0, next_beep - time.monotonic()))
+            if item is pipeline.STOP:
+                break
+            if item is not None:
+                latest = item
+                # Getting closer shortens the wait that's already running
+                next_beep = min(next_beep,
+                                last_beep + self.interval(latest[0]))
+
+            now = time.monotonic()
+            if now < next_beep:
+                continue
+            if latest is None or now - latest[1] > self.max_age:
+                # Nothing fresh (no climber, or route done), stay quiet
+                next_beep = now + self.min_interval
+                continue
+
+            distance = latest[0]
+            interval = self.interval(distance)
+            play_distance(distance, min(self.beep_length, interval / 2))
+            self.beeps += 1
+            self.ages.append(now - latest[1])
+            self.intervals.append(now - last_beep)
+            last_beep, next_beep = now, now + interval
+
+    def stats(self):
+        ages, intervals = list(self.ages), list(self.intervals)
+        return {"beeps": self.beeps,
+                "mean_age_ms": 1000 * sum(ages) / len(ages) if ages else 0.0,
+                "mean_interval_ms":
+                    1000 * sum(intervals) / len(intervals) if intervals else 0.0}
 
 def unknown_audio_input() -> None:
     play(frequency=203.88, duration=0.1, volume=0.5)
@@ -35,7 +225,7 @@ def unknown_audio_input() -> None:
 
 def main() -> None:
     """
-    Note: 
+    Note:
     Smallest noticable difference in frequency is roughly 0.05 * C_NATURAL.
     This is ignored in favour of a continuous distance -> frequency function.
     """
@@ -43,5 +233,19 @@ def main() -> None:
     # Play baseline
     play()
 
+    # Sweep the distance feedback and report how fast changes are heard
+    synth = get_synth()
+    for distance in range(300, -1, -10):
+        play_distance(distance, duration=None)
+        time.sleep(0.05)
+    synth.silence()
+    time.sleep(0.1)
+    latency = synth.latency_ms()
+    if latency is None:
+        print("Update to sound latency: no update was played")
+    else:
+        print(f"Update to sound latency: {latency:.1f} ms "
+              f"(stream output latency {1000 * synth.stream.latency:.1f} ms)")
+
 if __name__ == "__main__":
     main()
@@ -5,53 +5,311 @@ import audio_feedback
 # Create a recognizer instance
 recognizer = sr.Recognizer()
 
-# Use the default microphone as the source for audio input
-def input_audio_google_api():
-    with sr.Microphone() as source:
-        print("Speak something...")
-        # Adjust for ambient noise if necessary
-        recognizer.adjust_for_ambient_noise(source)
-        
-        # Listen for speech input from the microphone
-        audio = recognizer.listen(source)
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import sounddevice as sd
+import numpy as np
+
+SPEECH_MODEL = "facebook/wav2vec2-large-960h"
+
+# Speech recognition pipeline, built on first use (see get_speech_recognizer)
+_speech_recognizer = None
+_speech_recognizer_lock = threading.Lock()
+startup_times = {}  # seconds spent importing each engine and loading its model
+
+def get_speech_recognizer():
+    """Shared wav2vec2 pipeline, transformers is only imported and the model
+    only loaded the first time it's needed"""
+    global _speech_recognizer
+    with _speech_recognizer_lock:  # warmup() may be loading it already
+        if _speech_recognizer is None:
+            start_time = time.perf_counter()
+            from transformers import pipeline
+            startup_times["transformers_import"] = time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            # Initialize the pipeline for speech recognition
+            _speech_recognizer = pipeline("automatic-speech-recognition",
+                                          model=SPEECH_MODEL)
+            startup_times["wav2vec2_model_load"] = time.perf_counter() - start_time
+            print(f"Loaded {SPEECH_MODEL}: transformers import "
+                  f"{startup_times['transformers_import']:.1f}s, model load "
+                  f"{startup_times['wav2vec2_model_load']:.1f}s")
+    return _speech_recognizer
+
+# Offline keyword spotting: Vosk decoding only the command words, see
+# https://alphacephei.com/vosk/models for the small English model
+KEYWORD_MODEL = os.environ.get('IRCAT_VOSK_MODEL',
+                               'models/vosk-model-small-en-us-0.15')
+KEYWORDS = ["hand", "arm", "foot", "leg", "left", "right", "[unk]"]
+SAMPLE_RATE = 16000
+
+_keyword_model = None
+_keyword_spotter = None  # KeywordSpotter of recognize_keywords
+
+# Which recognizer input_audio() uses
+ENGINES = ('keywords', 'huggingface', 'google')
+engine = os.environ.get('IRCAT_SPEECH', 'keywords')
+FALLBACK_ENGINE = 'huggingface'  # used when vosk or its model can't load
+
+def set_engine(name):
+    """Choose the recognizer input_audio() uses"""
+    global engine
+    if name not in ENGINES:
+        raise ValueError(f"Unknown speech engine {name}, expected one of {ENGINES}")
+    engine = name
+
+def fall_back(error):
+    """Switch from the keyword spotter to FALLBACK_ENGINE after <error>
+    loading it"""
+    global engine
+    if engine != 'keywords':
+        return
+    print(f"Offline keyword spotting unavailable ({error}). Install vosk and "
+          f"download its model to {KEYWORD_MODEL} (or set IRCAT_VOSK_MODEL) "
+          f"to use it, falling back to --speech {FALLBACK_ENGINE}.")
+    engine = FALLBACK_ENGINE
+
+def get_keyword_model(path=KEYWORD_MODEL):
+    """Shared Vosk model, loaded on first use like get_speech_recognizer"""
+    global _keyword_model
+    with _speech_recognizer_lock:
+        if _keyword_model is None:
+            if not os.path.isdir(path):
+                raise FileNotFoundError(f"no Vosk model at {path}")
+            start_time = time.perf_counter()
+            import vosk
+            vosk.SetLogLevel(-1)
+            startup_times["vosk_import"] = time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            _keyword_model = vosk.Model(path)
+            startup_times["vosk_model_load"] = time.perf_counter() - start_time
+            print(f"Loaded {path}: vosk import "
+                  f"{startup_times['vosk_import']:.1f}s, model load "
+                  f"{startup_times['vosk_model_load']:.1f}s")
+    return _keyword_model
+
+def to_pcm(audio):
+    """16 bit PCM bytes of a float32 [-1, 1] or int16 array"""
+    audio = np.asarray(audio)
+    if audio.dtype != np.int16:
+        audio = (np.clip(audio, -1.0, 1.0) * 32767).astype(np.int16)
+    return audio.tobytes()
+
+class KeywordSpotter:
+    """Recognizes limb commands with a decoder restricted to KEYWORDS.
+
+    Anything else said comes out as [unk], so there's nothing to mishear as
+    a command and decoding a short utterance is fast on a CPU. Audio can be
+    fed in chunks while it's recorded (feed) or all at once (recognize).
+    """
+
+    def __init__(self, model=None, sample_rate=SAMPLE_RATE):
+        import vosk
+        self.model = model or get_keyword_model()
+        self.sample_rate = sample_rate
+        self.grammar = json.dumps(KEYWORDS)
+        self.decoder = vosk.KaldiRecognizer(self.model, sample_rate,
+                                            self.grammar)
+
+    def feed(self, audio):
+        """Decode the next chunk of an utterance"""
+        self.decoder.AcceptWaveform(to_pcm(audio))
+
+    def result(self):
+        """Words of the utterance fed so far, the decoder is then reset for
+        the next one"""
+        words = json.loads(self.decoder.FinalResult()).get("text", "")
+        self.decoder.Reset()
+        return words
+
+    def recognize(self, audio):
+        """(hand_foot, right_left, words) of a whole utterance, -1 for a
+        part that wasn't said"""
+        self.feed(audio)
+        words = self.result()
+        hand_foot, right_left = parse_command(words)
+        return hand_foot, right_left, words
+
+def load_engine():
+    """Load the current engine's model, falling back from the keyword
+    spotter if it can't be loaded"""
+    if engine == 'keywords':
+        try:
+            get_keyword_model()
+            return
+        except Exception as error:  # no vosk, or no model at KEYWORD_MODEL
+            fall_back(error)
+    if engine == 'huggingface':
+        get_speech_recognizer()
+    # google has nothing to load, it's a web API
+
+def _warmup():
+    try:
+        load_engine()
+    except Exception as error:
+        # input_audio() tries again and reports it on the first command
+        print(f"Speech model warmup failed: {type(error).__name__}: {error}")
+
+def warmup():
+    """Load the speech model on a background thread, e.g. while the wall is
+    being calibrated"""
+    if engine == 'google':
+        return None  # nothing to load, it's a web API
+    thread = threading.Thread(target=_warmup, name="speech-warmup", daemon=True)
+    thread.start()
+    return thread
+
+class SpeechListener:
+    """Continuous microphone capture, cut into utterances by an energy gate.
+
+    One input stream stays open for the whole climb. Blocks quieter than
+    <threshold_ratio> times the background noise are silence, and the noise
+    level keeps adapting during silence instead of being measured again
+    before every command. A short pre-roll keeps the start of each word.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, block_ms=30, pre_roll_ms=300,
+                 hangover_ms=300, min_speech_ms=150, max_speech_s=4.0,
+                 threshold_ratio=3.0, min_rms=0.005, calibration_ms=500):
+        """
+        <hangover_ms>:      silence that ends an utterance
+        <min_speech_ms>:    shorter sounds (clicks, bumps) are ignored
+        <max_speech_s>:     sound this long is background noise, which the
+                            noise level is raised to
+        <threshold_ratio>:  speech is this many times louder than the noise
+        <min_rms>:          lowest threshold, for a very quiet room
+        <calibration_ms>:   background noise measured when the stream starts
+        """
+        self.sample_rate = sample_rate
+        self.block_size = sample_rate * block_ms // 1000
+        blocks = lambda ms: max(1, int(ms // block_ms))
+        self.pre_roll_blocks = blocks(pre_roll_ms)
+        self.hangover_blocks = blocks(hangover_ms)
+        self.min_speech_blocks = blocks(min_speech_ms)
+        self.max_speech_blocks = blocks(1000 * max_speech_s)
+        self.calibration_blocks = blocks(calibration_ms)
+        self.threshold_ratio = threshold_ratio
+        self.min_rms = min_rms
+
+        self.blocks = queue.Queue(maxsize=blocks(10000))  # ~10 s of backlog
+        self.noise = None  # background RMS, kept across utterances
+        self.dropped = 0
+        self.noise_changes = 0  # max length cuts taken as louder background
+        self.latencies = deque(maxlen=50)  # (end of speech -> command,
+                                           #  recognition) seconds
+        self.stream = None
+
+    def start(self):
+        self.stream = sd.InputStream(samplerate=self.sample_rate, channels=1,
+                                     dtype='float32',
+                                     blocksize=self.block_size,
+                                     callback=self._callback)
+        self.stream.start()
+        return self
 
+    def _callback(self, indata, frames, time_info, status):
         try:
-            print("Recognizing...")
-            # Use Google Web Speech API to convert audio to text
-            text = recognizer.recognize_google(audio, language='en-US') # Change language if needed
-            print(f"You said: {text}")
-
-            hand_foot, right_left = None, None
-            if "hand" in text or "arm" in text:
-                hand_foot = 0
-            elif "foot" in text or "leg" in text:
-                hand_foot = 1
-            
-            if "right" in text:
-                right_left = 0
-            elif "left" in text:
-                right_left = 1
-            
-            if (hand_foot is not None) and (right_left is not None):
-                return hand_foot, right_left
+            self.blocks.put_nowait((indata[:, 0].copy(), time.monotonic()))
+        except queue.Full:
+            self.dropped += 1
+
+    def threshold(self):
+        return max(self.noise * self.threshold_ratio, self.min_rms)
+
+    def calibrate(self):
+        """Measure the background noise, the climber should be quiet"""
+        levels = []
+        while len(levels) < self.calibration_blocks:
+            block, _ = self.blocks.get()
+            levels.append(np.sqrt(np.mean(block ** 2)))
+        self.noise = float(np.median(levels))
+
+    def next_utterance(self):
+        """(float32 samples, time.monotonic() the speech ended) of the next
+        thing said"""
+        if self.noise is None:
+            self.calibrate()
+
+        pre_roll = deque(maxlen=self.pre_roll_blocks)
+        speech, voiced_blocks, silent_blocks, speech_end = [], 0, 0, None
+        levels = []  # RMS of every block of the utterance
+        while True:
+            block, block_time = self.blocks.get()
+            rms = float(np.sqrt(np.mean(block ** 2)))
+            voiced = rms > self.threshold()
+
+            if not speech:
+                if voiced:
+                    speech = list(pre_roll) + [block]
+                    voiced_blocks, silent_blocks = 1, 0
+                    speech_end = block_time
+                    levels = [rms]
+                else:
+                    pre_roll.append(block)
+                    self.noise += 0.05 * (rms - self.noise)  # follow the room
+                continue
+
+            speech.append(block)
+            levels.append(rms)
+            if voiced:
+                voiced_blocks += 1
+                silent_blocks = 0
+                speech_end = block_time
             else:
-                # Alert climber for restatement
-                audio_feedback.unknown_audio_input()
-                
-        except sr.UnknownValueError:
-            print("Sorry, could not understand the audio.")
-            pass
-        except sr.RequestError as e:
-            print(f"Error fetching results; {e}")
-            pass
-        return -1, -1
+                silent_blocks += 1
 
-from transformers import pipeline
-import sounddevice as sd
-import numpy as np
+            if len(speech) >= self.max_speech_blocks:
+                # Nobody says a limb command this long, the background got
+                # louder (music, a fan) and every block passes the gate.
+                # Follow it up instead of sending noise to the recognizer.
+                self.noise = max(self.noise, float(np.median(levels)))
+                self.noise_changes += 1
+                speech = []
+                pre_roll.clear()
+                continue
+
+            if silent_blocks >= self.hangover_blocks:
+                if voiced_blocks >= self.min_speech_blocks:
+                    return np.concatenate(speech), speech_end
+                # Too short to be a word, keep listening
+                speech = []
+                pre_roll.clear()
+
+    def record_latency(self, command_latency, recognition_time):
+        self.latencies.append((command_latency, recognition_time))
+
+    def stats(self):
+        if not self.latencies:
+            return {"utterances": 0, "dropped": self.dropped,
+                    "noise_changes": self.noise_changes}
+        command, recognition = np.mean(self.latencies, axis=0) * 1000
+        return {"utterances": len(self.latencies), "dropped": self.dropped,
+                "noise_changes": self.noise_changes,
+                "end_of_speech_to_command_ms": command,
+                "recognition_ms": recognition,
+                "noise_rms": self.noise}
 
-# Initialize the pipeline for speech recognition
-speech_recognizer = pipeline("automatic-speech-recognition", model="facebook/wav2vec2-large-960h")
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+
+_listener = None
+
+def get_listener():
+    """Shared SpeechListener, the microphone stream is opened once"""
+    global _listener
+    if _listener is None:
+        _listener = SpeechListener().start()
+    return _listener
 
 def record_audio(duration=5, sr=16000):
     # Function to record audio from the microphone
@@ -60,6 +318,22 @@ def record_audio(duration=5, sr=16000):
     sd.wait()
     return np.squeeze(audio)
 
+def parse_command(text):
+    """(hand_foot, right_left) of the words in <text>, -1 for a part that
+    wasn't said"""
+    words = text.split()
+    hand_foot, right_left = -1, -1
+    if "hand" in words or "arm" in words:
+        hand_foot = 0
+    elif "foot" in words or "leg" in words:
+        hand_foot = 1
+
+    if "right" in words:
+        right_left = 0
+    elif "left" in words:
+        right_left = 1
+    return hand_foot, right_left
+
 def process_speech(text):
     hand_foot, right_left = None, None
     if "hand" in text or "arm" in text:
@@ -81,73 +355,69 @@ def process_speech(text):
         # Perform necessary action for unknown input
         return -1, -1
 
-def input_audio_huggingface(duration=3):
-    with sr.Microphone() as source:
-        print("Speak something...")
-        # Adjust for ambient noise if necessary
-        recognizer.adjust_for_ambient_noise(source)
-        
-        # Listen for speech input from the microphone
-        audio = recognizer.listen(source)
-
+def recognize_keywords(audio):
+    """Words of the float32 <audio> from the offline KeywordSpotter"""
+    global _keyword_spotter
+    if _keyword_spotter is None:
         try:
-            print("Recognizing...")
-            # Use Google Web Speech API to convert audio to text
-            text = speech_recognizer(audio)
-            transcription = text['text'].lower()
-            print(f"You said: {transcription}")
-
-            hand_foot, right_left = None, None
-            if "hand" in text or "arm" in text:
-                hand_foot = 0
-            elif "foot" in text or "leg" in text:
-                hand_foot = 1
-            
-            if "right" in text:
-                right_left = 0
-            elif "left" in text:
-                right_left = 1
-            
-            if (hand_foot is not None) and (right_left is not None):
-                return hand_foot, right_left
-            else:
-                # Alert climber for restatement
-                audio_feedback.unknown_audio_input()
-                
-        except sr.UnknownValueError:
-            print("Sorry, could not understand the audio.")
-            pass
-        except sr.RequestError as e:
-            print(f"Error fetching results; {e}")
-            pass
-        return -1, -1
+            _keyword_spotter = KeywordSpotter()
+        except Exception as error:  # no vosk, or no model at KEYWORD_MODEL
+            fall_back(error)
+            return RECOGNIZERS[engine](audio)
+    return _keyword_spotter.recognize(audio)[2]
 
+def recognize_huggingface(audio):
+    """Words of the float32 <audio> from wav2vec2"""
+    text = get_speech_recognizer()({"raw": audio, "sampling_rate": SAMPLE_RATE})
+    return text['text'].lower()
 
-    # try:
-    #     # # Record audio from the microphone for a specified duration (in seconds)
-    #     # audio_data = record_audio(duration)
-        
-    #     # Perform speech recognition
-    #     text = speech_recognizer(audio_data)
-    #     transcription = text['text'].lower()
-    #     print(f"You said: {transcription}")
+def recognize_google(audio):
+    """Words of the float32 <audio> from Google's Web Speech API"""
+    audio_data = sr.AudioData(to_pcm(audio), SAMPLE_RATE, 2)
+    # Change language if needed
+    return recognizer.recognize_google(audio_data, language='en-US').lower()
 
-    #     # Process the recognized text
-    #     return process_speech(transcription)
+RECOGNIZERS = {'keywords': recognize_keywords,
+               'huggingface': recognize_huggingface,
+               'google': recognize_google}
 
-    # except Exception as e:
-    #     print(f"Error: {e}")
-    #     pass
-    # return -1, -1
+def input_audio():
+    """(hand_foot, right_left) of the climber's next command, (-1, -1) if it
+    wasn't understood"""
+    listener = get_listener()
+    print("Speak something...")
+    audio, speech_end = listener.next_utterance()
 
+    print("Recognizing...")
+    recognize_start = time.monotonic()
+    try:
+        words = RECOGNIZERS[engine](audio)
+    except sr.UnknownValueError:
+        words = ""
+    except sr.RequestError as e:
+        print(f"Error fetching results; {e}")
+        return -1, -1
+    except Exception as error:  # e.g. the speech model failed to load
+        print(f"Speech recognition failed: {type(error).__name__}: {error}")
+        return -1, -1
+    now = time.monotonic()
+    listener.record_latency(now - speech_end, now - recognize_start)
+    print(f"You said: {words} ({1000 * (now - speech_end):.0f} ms after you "
+          f"stopped, {1000 * (now - recognize_start):.0f} ms recognizing)")
 
-def input_audio():
-    # return input_audio_google_api()
-    return input_audio_huggingface()
+    hand_foot, right_left = parse_command(words)
+    if hand_foot != -1 and right_left != -1:
+        return hand_foot, right_left
+    # Alert climber for restatement
+    audio_feedback.unknown_audio_input()
+    return -1, -1
 
 def main():
-    while True:
-        input_audio()
+    try:
+        while True:
+            input_audio()
+    except KeyboardInterrupt:
+        print(get_listener().stats())
 
 if "__main__" == __name__:
     main()
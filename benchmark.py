@@ -0,0 +1,532 @@
+# This file will be for:
+# 1. Timing the hot paths of the tool against their original versions
+# 2. Running on the images in test_images/ so results are reproducible
+#
+# Usage: python benchmark.py <benchmark> [options]
+
+
+import argparse
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+from supervision.detection.core import Detections
+
+TEST_IMAGES = sorted(glob.glob('test_images/*'))
+
+
+def synthetic_boxes(image, count, seed=0):
+    """<count> random hold sized boxes inside <image>"""
+    rng = np.random.default_rng(seed)
+    height, width = image.shape[:2]
+    corners = rng.uniform(0, [width - 100, height - 100], (count, 2))
+    sizes = rng.uniform(20, 100, (count, 2))
+    return Detections(np.hstack([corners, corners + sizes]).astype(np.float32))
+
+
+def get_boxes(image, args):
+    # Real detections need the weights, synthetic ones don't
+    if args.synthetic:
+        return synthetic_boxes(image, args.synthetic)
+    import hold_model
+    return hold_model.detect_holds(image, confidence=0.5)
+
+
+def time_call(function, *args, repeat=3):
+    """Best wall time of <repeat> calls and the result of the last one"""
+    best = float('inf')
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start_time)
+    return best, result
+
+
+def route_sizes(routes):
+    return {colour: len(detections) for colour, detections in routes.items()}
+
+
+def bench_routes(args):
+    import find_routes
+
+    for path in args.images:
+        image = cv2.imread(path)
+        detections = get_boxes(image, args)
+
+        # Both draw the routes on the image, so each call gets a fresh copy
+        old_time, old_routes = time_call(
+            lambda: find_routes.identify_routes_contours(image.copy(), detections))
+        new_time, new_routes = time_call(
+            lambda: find_routes.identify_routes(image.copy(), detections))
+
+        print(f"{path}: {len(detections)} holds")
+        print(f"  contours: {old_time * 1000:8.1f} ms  {route_sizes(old_routes)}")
+        print(f"  blobs:    {new_time * 1000:8.1f} ms  {route_sizes(new_routes)}")
+        print(f"  speedup:  {old_time / new_time:8.1f}x")
+
+
+def match_detections(reference, candidate, iou_threshold=0.5):
+    """Pairs of (reference index, candidate index) with IoU >= <iou_threshold>,
+    best pairs first, each box used once"""
+    from hold_fusion import box_iou
+    if len(reference) == 0 or len(candidate) == 0:
+        return []
+    iou = box_iou(reference.xyxy, candidate.xyxy)
+    pairs = np.argwhere(iou >= iou_threshold)
+    pairs = pairs[np.argsort(-iou[pairs[:, 0], pairs[:, 1]])]
+    used_reference, used_candidate, matches = set(), set(), []
+    for i, j in pairs:
+        if i not in used_reference and j not in used_candidate:
+            used_reference.add(i)
+            used_candidate.add(j)
+            matches.append((i, j))
+    return matches
+
+
+def bench_backends(args):
+    import hold_model
+
+    models = {name: hold_model.get_model(backend_name=name)
+              for name in ['torch'] + args.backends}
+    # Over all images: [boxes matched to torch's, torch's boxes, own boxes,
+    # labelled holds found, labelled holds]
+    totals = {name: np.zeros(5, dtype=int) for name in models}
+
+    for path in args.images:
+        image = cv2.imread(path)
+        labels = load_labels(path, image)
+        results = {}
+        for name, model in models.items():
+            latency, detections = time_call(hold_model.detect_holds, image,
+                                            args.confidence, model,
+                                            repeat=args.repeat)
+            results[name] = (latency, detections)
+
+        reference_time, reference = results['torch']
+        print(f"{path}: torch {len(reference)} holds, "
+              f"{reference_time * 1000:.1f} ms/frame")
+        for name, (_, detections) in results.items():
+            totals[name][:3] += len(match_detections(reference, detections)), \
+                len(reference), len(detections)
+            if labels is not None:
+                totals[name][3:] += len(match_detections(
+                    Detections(labels.astype(np.float32)), detections)), \
+                    len(labels)
+        for name in args.backends:
+            latency, detections = results[name]
+            matches = match_detections(reference, detections)
+            recall = len(matches) / max(len(reference), 1)
+            precision = len(matches) / max(len(detections), 1)
+            confidence_error = np.mean([
+                abs(reference.confidence[i] - detections.confidence[j])
+                for i, j in matches]) if matches else float('nan')
+            print(f"  {name:14s} {latency * 1000:8.1f} ms/frame "
+                  f"({reference_time / latency:4.1f}x)  "
+                  f"box agreement: recall {recall:.2f} precision {precision:.2f}  "
+                  f"mean |conf diff| {confidence_error:.3f}")
+
+    # Speed only counts if the quantized models still find the same holds
+    print("Over all images:")
+    for name, (matched, reference, own, found, labelled) in totals.items():
+        line = f"  {name:14s}"
+        if name != 'torch':
+            line += (f" match rate vs torch {matched / max(reference, 1):.2f} "
+                     f"(precision {matched / max(own, 1):.2f})")
+        if labelled:
+            line += f"  recall of labelled holds {found / labelled:.2f}"
+        if name != 'torch' or labelled:
+            print(line)
+
+
+def load_labels(image_path, image):
+    """YOLO format labels next to <image_path> as xyxy pixels, or None"""
+    label_path = os.path.splitext(image_path)[0] + '.txt'
+    if not os.path.exists(label_path):
+        return None
+    height, width = image.shape[:2]
+    labels = np.loadtxt(label_path, ndmin=2)[:, 1:5]
+    centers, sizes = labels[:, :2], labels[:, 2:] / 2
+    return np.hstack([centers - sizes, centers + sizes]) * \
+        [width, height, width, height]
+
+
+def bench_tiles(args):
+    import hold_model
+    model = hold_model.get_model()
+
+    for path in args.images:
+        image = cv2.imread(path)
+        full_time, full = time_call(hold_model.detect_holds, image,
+                                    args.confidence, model, False,
+                                    repeat=args.repeat)
+        tiled_time, tiled = time_call(
+            lambda: hold_model.detect_holds_tiled(image, args.confidence, model,
+                                                  tile_size=args.tile_size),
+            repeat=args.repeat)
+
+        def small(detections):
+            areas = (detections.xyxy[:, 2] - detections.xyxy[:, 0]) * \
+                (detections.xyxy[:, 3] - detections.xyxy[:, 1])
+            return int(np.sum(areas < args.small_size ** 2))
+
+        print(f"{path}: {hold_model.tile_stats['run']} tiles run, "
+              f"{hold_model.tile_stats['skipped']} skipped")
+        print(f"  full frame: {full_time * 1000:8.1f} ms ({1 / full_time:5.2f} fps) "
+              f"{len(full)} holds, {small(full)} small")
+        print(f"  tiled:      {tiled_time * 1000:8.1f} ms ({1 / tiled_time:5.2f} fps) "
+              f"{len(tiled)} holds, {small(tiled)} small")
+
+        labels = load_labels(path, image)
+        if labels is None:
+            continue
+        label_areas = (labels[:, 2] - labels[:, 0]) * (labels[:, 3] - labels[:, 1])
+        small_labels = Detections(labels[label_areas < args.small_size ** 2])
+        for name, detections in (("full frame", full), ("tiled", tiled)):
+            recall = len(match_detections(small_labels, detections)) / \
+                max(len(small_labels), 1)
+            print(f"  {name} small hold recall: {recall:.2f} "
+                  f"({len(small_labels)} labelled)")
+
+
+def _legacy_round_pixel(pixel):
+    return (round(pixel[0], -1), round(pixel[1], -1), round(pixel[2], -1))
+
+
+def _legacy_process_detection(args):
+    # The original one_img.process_detection: every task re-reads the image
+    # and gets a whole pickled detection tuple
+    detection, image_path = args
+    from collections import Counter
+    image = cv2.imread(image_path)
+    x1, y1, x2, y2 = map(int, detection[0])
+    lst = [_legacy_round_pixel(pixel) for row in image[y1:y2, x1:x2, :]
+           for pixel in row]
+    c = Counter(lst)
+    most_common, count = c.most_common(1)[0]
+    if count / len(lst) < 0.5:
+        return c.most_common(2)[1][0]
+    return most_common
+
+
+def bench_colours(args):
+    import pickle
+    from multiprocessing import Pool
+    import one_img
+
+    for path in args.images:
+        image = cv2.imread(path)
+        detections = get_boxes(image, args)
+
+        decode_time, _ = time_call(cv2.imread, path)
+        legacy_tasks = [(detection, path) for detection in detections]
+        chunk_size = args.chunk_size
+        boxes = detections.xyxy.astype(int)
+        shared_tasks = [(boxes[i:i + chunk_size], 0.5)
+                        for i in range(0, len(boxes), chunk_size)]
+        legacy_bytes = sum(len(pickle.dumps(task)) for task in legacy_tasks)
+        shared_bytes = sum(len(pickle.dumps(task)) for task in shared_tasks)
+
+        def legacy():
+            with Pool(args.workers) as pool:
+                return pool.map(_legacy_process_detection, legacy_tasks)
+
+        legacy_time, _ = time_call(legacy, repeat=1)
+        serial_time, _ = time_call(one_img.dominant_colours, image, detections)
+        shared_time, _ = time_call(one_img.dominant_colours_parallel, image,
+                                   detections, 0.5, args.workers, chunk_size)
+
+        print(f"{path}: {len(detections)} holds, decode {decode_time * 1000:.0f} ms")
+        print(f"  pool + re-read:  {legacy_time * 1000:8.1f} ms  "
+              f"{len(legacy_tasks)} tasks, {legacy_bytes / 1024:.1f} KiB pickled, "
+              f"{len(legacy_tasks)} decodes")
+        print(f"  shared memory:   {shared_time * 1000:8.1f} ms  "
+              f"{len(shared_tasks)} tasks, {shared_bytes / 1024:.1f} KiB pickled, "
+              f"0 decodes")
+        print(f"  single process:  {serial_time * 1000:8.1f} ms")
+
+
+def _legacy_get_relative_distance(center_limb_pt, rock_hold):
+    rock_hold_pos = rock_hold[0]
+    x1, y1, x2, y2 = \
+        rock_hold_pos[0], rock_hold_pos[1], rock_hold_pos[2], rock_hold_pos[3]
+    mean_rock_coord = np.mean(np.array([[x1, y1], [x2, y2]]), axis=0)
+    return np.linalg.norm(abs(center_limb_pt[:2] - mean_rock_coord))
+
+
+def _legacy_find_closest_hold(hand_point, detections, grabbed_areas):
+    # The original main.find_closest_hold, minus its debug print
+    closest_detection = None
+    min_distance = float('inf')
+    for detection in detections:
+        if any(np.array_equal(grabbed[0], detection[0])
+               for grabbed in grabbed_areas):
+            continue
+        distance = _legacy_get_relative_distance(hand_point, detection)
+        if distance < min_distance:
+            min_distance = distance
+            closest_detection = detection
+    return closest_detection
+
+
+def bench_nearest(args):
+    from route_state import RouteState
+
+    wall = np.zeros((2160, 3840, 3), dtype=np.uint8)
+    rng = np.random.default_rng(0)
+    for count in (10, 100, 1000):
+        detections = synthetic_boxes(wall, count)
+        route = RouteState(detections)
+        # Half of the route already climbed
+        grabbed = rng.choice(count, count // 2, replace=False)
+        route.grabbed[grabbed] = True
+        grabbed_areas = [(detections.xyxy[i],) for i in grabbed]
+        limb = np.array([1900.0, 1000.0])
+
+        old_time, old = time_call(_legacy_find_closest_hold, limb,
+                                  list(detections), grabbed_areas)
+        new_time, new = time_call(route.nearest_unvisited, limb)
+        assert np.array_equal(old[0], route.box(new))
+        print(f"{count:5d} holds:  loop {old_time * 1000:9.3f} ms   "
+              f"vectorized {new_time * 1000:7.3f} ms   "
+              f"({old_time / new_time:.0f}x)")
+
+
+def _legacy_limb_centroids(landmark_list, frame_shape):
+    # The original main.py path: a dict of landmarks, one int32 array per
+    # limb built point by point, then np.mean on each
+    names = {"right_hand": [18, 20, 22, 16], "left_hand": [17, 19, 21, 15],
+             "right_foot": [28, 30, 32], "left_foot": [27, 29, 31]}
+    d = {index: landmark_list[index] for index in range(len(landmark_list))}
+    return [np.mean(np.array([[int(d[i].x * frame_shape[1]),
+                               int(d[i].y * frame_shape[0])]
+                              for i in indices], np.int32), axis=0)
+            for indices in names.values()]
+
+
+def bench_landmarks(args):
+    from types import SimpleNamespace
+    import landmarks
+
+    rng = np.random.default_rng(0)
+    frame_shape = (1080, 1920, 3)
+    landmark_list = [SimpleNamespace(x=x, y=y, z=z, visibility=v)
+                     for x, y, z, v in rng.uniform(0, 1, (landmarks.NUM_LANDMARKS, 4))]
+    buffer = np.empty((landmarks.NUM_LANDMARKS, 4), np.float32)
+
+    def array_path():
+        pose_array = landmarks.to_array(landmark_list, out=buffer)
+        return landmarks.limb_centroids(pose_array, frame_shape)
+
+    frames = 1000
+    old_time, old = time_call(
+        lambda: [_legacy_limb_centroids(landmark_list, frame_shape)
+                 for _ in range(frames)], repeat=args.repeat)
+    new_time, new = time_call(
+        lambda: [array_path() for _ in range(frames)], repeat=args.repeat)
+    # The old path truncated every point to whole pixels first
+    error = np.abs(np.array(old[-1]) - new[-1]).max()
+    print(f"dict + per limb arrays: {old_time / frames * 1e6:7.1f} us/frame")
+    print(f"(33, 4) array + matmul: {new_time / frames * 1e6:7.1f} us/frame "
+          f"({old_time / new_time:.1f}x), max centroid difference {error:.2f} px")
+
+
+def synthetic_limbs(seconds=20, fps=30, jitter=4.0, seed=0):
+    """Timestamps, true and jittery (frames, 4, 2) limb positions of a
+    climber reaching between holds"""
+    rng = np.random.default_rng(seed)
+    timestamps = np.arange(0, seconds, 1 / fps)
+    # Each limb moves smoothly from hold to hold, one reach every ~2 s
+    phases = rng.uniform(0, 2 * np.pi, (4, 2))
+    truth = np.stack([
+        900 + 300 * np.sin(0.5 * timestamps[:, None] + phases[:, 0])
+        * np.sin(1.3 * timestamps[:, None] + phases[:, 1]),
+        500 + 200 * np.sin(0.4 * timestamps[:, None] + phases[:, 1])
+    ], axis=-1)
+    noisy = truth + rng.normal(0, jitter, truth.shape)
+    return timestamps, truth, noisy
+
+
+def bench_filter(args):
+    import limb_filter
+
+    if args.limbs:
+        recording = np.load(args.limbs)
+        timestamps, noisy = recording["timestamps"], recording["points"]
+        truth = None  # the raw positions are the only reference
+    else:
+        timestamps, truth, noisy = synthetic_limbs()
+    reference = noisy if truth is None else truth
+
+    def shifted(lead):
+        """Reference position <lead> seconds after every frame"""
+        target_times = np.minimum(timestamps + lead, timestamps[-1])
+        flat = reference.reshape(len(timestamps), -1)
+        return np.stack([np.interp(target_times, timestamps, column)
+                         for column in flat.T], axis=-1).reshape(reference.shape)
+
+    def jitter(points):
+        # RMS second difference, what the climber hears as wobble
+        return float(np.sqrt(np.mean(np.diff(points, n=2, axis=0) ** 2)))
+
+    def error(points, target):
+        return float(np.mean(np.linalg.norm(points - target, axis=-1)))
+
+    leads = args.predict_ms or [0, 50, 100, 150]
+    print(f"{len(timestamps)} frames, {'recorded' if truth is None else 'synthetic'}")
+    print(f"  raw:               jitter {jitter(noisy):6.2f} px")
+    # None is the default lead main.py uses, latency matched
+    for lead_ms in [None] + list(leads):
+        smoother = limb_filter.LimbFilter(args.min_cutoff, args.beta,
+                                          predict_ms=lead_ms)
+        predicted = np.stack([smoother.update(points, t)
+                              for t, points in zip(timestamps, noisy)])
+        lead = smoother.lead()
+        target = shifted(lead)
+        name = "default" if lead_ms is None else "predict"
+        print(f"  {name} {1000 * lead:4.0f} ms:  jitter {jitter(predicted):6.2f} px  "
+              f"error {error(predicted, target):6.2f} px  "
+              f"(raw, stale by {1000 * lead:.0f} ms: {error(noisy, target):6.2f} px)")
+        if lead_ms is None:
+            # Smoothing is half the point, the prediction mustn't undo it
+            assert jitter(predicted) < jitter(noisy), \
+                "the default lead is jitterier than the raw landmarks"
+
+
+def bench_render(args):
+    import supervision as sv
+    import overlay
+    from route_state import RouteState
+
+    frame = np.zeros((1080, 1920, 3), dtype=np.uint8)
+    detections = synthetic_boxes(frame, 40)
+    route = RouteState(detections)
+    colour = sv.Color(0, 0, 255)
+    route_overlay = overlay.RouteOverlay(route, colour.as_rgb())
+
+    def legacy():
+        # The original per-frame route drawing in main.py
+        image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        box_annotator = sv.BoxAnnotator(color=colour, thickness=3,
+                                        text_thickness=2, text_scale=1)
+        box_annotator.annotate(scene=image, detections=detections,
+                               skip_label=True)
+        return cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+
+    frames = 100
+    old_time, old = time_call(lambda: [legacy() for _ in range(frames)],
+                              repeat=args.repeat)
+    # Rendering draws on the captured frame in place, no copy
+    image = frame.copy()
+    new_time, _ = time_call(
+        lambda: [route_overlay.apply(image) for _ in range(frames)],
+        repeat=args.repeat)
+    assert np.array_equal(old[-1], route_overlay.apply(frame.copy()))
+    print(f"annotator + cvtColor:  {old_time / frames * 1000:6.2f} ms/frame")
+    print(f"cached overlay:        {new_time / frames * 1000:6.2f} ms/frame "
+          f"({old_time / new_time:.1f}x, {route_overlay.rebuilds} rebuild)")
+
+
+def load_wav(path):
+    """float32 mono samples and sample rate of a 16 bit WAV file"""
+    import wave
+    with wave.open(path, 'rb') as file:
+        rate, channels = file.getframerate(), file.getnchannels()
+        samples = np.frombuffer(file.readframes(file.getnframes()), np.int16)
+    samples = samples.reshape(-1, channels).mean(axis=1)
+    return (samples / 32768).astype(np.float32), rate
+
+
+def clip_label(path):
+    """(hand_foot, right_left) a clip is named after, e.g. left_leg_03.wav
+    is (1, 1). Clips named otherwise (e.g. noise_01.wav) expect (-1, -1)."""
+    import audio_input
+    name = os.path.splitext(os.path.basename(path))[0].replace('_', ' ')
+    return audio_input.parse_command(name)
+
+
+def bench_keywords(args):
+    import audio_input
+
+    paths = sorted(glob.glob(os.path.join(args.clips, '*.wav')))
+    if not paths:
+        print(f"No WAV clips in {args.clips}, record some named like "
+              f"right_hand_01.wav (16 kHz mono)")
+        return
+
+    load_time, _ = time_call(audio_input.get_keyword_model, repeat=1)
+    print(f"Model loaded in {load_time * 1000:.0f} ms")
+    latencies, correct = [], 0
+    for path in paths:
+        audio, rate = load_wav(path)
+        spotter = audio_input.KeywordSpotter(sample_rate=rate)
+        latency, (hand_foot, right_left, words) = time_call(
+            spotter.recognize, audio, repeat=1)
+        expected = clip_label(path)
+        ok = (hand_foot, right_left) == expected
+        correct += ok
+        latencies.append(latency)
+        print(f"  {'ok ' if ok else 'BAD'} {os.path.basename(path):28s} "
+              f"heard '{words}' {latency * 1000:6.1f} ms")
+
+    latencies = np.array(latencies) * 1000
+    print(f"Accuracy {correct}/{len(paths)} ({correct / len(paths):.0%}), "
+          f"latency mean {latencies.mean():.1f} ms, "
+          f"p95 {np.percentile(latencies, 95):.1f} ms, "
+          f"max {latencies.max():.1f} ms, "
+          f"{np.mean(latencies < 200):.0%} under 200 ms")
+
+
+BENCHMARKS = {
+    "routes": bench_routes,
+    "backends": bench_backends,
+    "tiles": bench_tiles,
+    "colours": bench_colours,
+    "nearest": bench_nearest,
+    "landmarks": bench_landmarks,
+    "filter": bench_filter,
+    "render": bench_render,
+    "keywords": bench_keywords,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the IRCAT hot paths")
+    parser.add_argument("benchmark", choices=BENCHMARKS.keys())
+    parser.add_argument("--images", nargs="+", default=TEST_IMAGES,
+                        help="images to run on (default: test_images/)")
+    parser.add_argument("--synthetic", type=int, default=0, metavar="N",
+                        help="use N random boxes instead of the YOLO model")
+    parser.add_argument("--backends", nargs="+",
+                        default=['onnx', 'onnx-int8'],
+                        help="backends compared against torch (backends)")
+    parser.add_argument("--confidence", type=float, default=0.5,
+                        help="detection confidence threshold")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="timed runs per image, the best one is kept")
+    parser.add_argument("--tile-size", type=int, default=640,
+                        help="tile size in pixels (tiles)")
+    parser.add_argument("--small-size", type=int, default=64,
+                        help="holds smaller than this squared are small (tiles)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes, default one per CPU (colours)")
+    parser.add_argument("--chunk-size", type=int, default=32,
+                        help="boxes per worker task (colours)")
+    parser.add_argument("--limbs", default=None, metavar="NPZ",
+                        help="limb positions saved by main.py --record-limbs "
+                             "(filter, default: synthetic)")
+    parser.add_argument("--predict-ms", type=float, nargs="+", default=None,
+                        help="prediction horizons to compare (filter)")
+    parser.add_argument("--min-cutoff", type=float, default=0.5,
+                        help="One-Euro cutoff of a still limb (filter)")
+    parser.add_argument("--beta", type=float, default=0.05,
+                        help="One-Euro speed coefficient (filter)")
+    parser.add_argument("--clips", default="test_audio",
+                        help="folder of WAV clips named after the command "
+                             "(keywords)")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+if "__main__" == __name__:
+    main()
@@ -1,22 +1,39 @@
 import cv2
-import supervision as sv
 import time
 
+import display
+import hold_model
+
 def calibrate_holds(start_time, detections, model, frame, box_annotator, image, 
-                    calibrated):
+                    calibrated, fusion=None, timestamp=None):
+    """
+    <start_time>:   timestamp calibration started at
+    <timestamp>:    capture time of <frame>, on the same clock as
+                    <start_time>, defaults to time.time(). The source's
+                    frame timestamps make --fast replays calibrate on the
+                    same frames every run.
+    """
     print(f"Calibrating... " + " " * 20, end='\r')
     # check if it's been 10 seconds
     # break when you reach 10 seconds
 
     calibrate_time = 20
+    min_calibrate_time = 5 # never stop before this, even if converged
     # check if it's been calibrate_time seconds
     # break when you reach calibrate_time seconds
-    elapsed_time = time.time() - start_time
-
-    if elapsed_time <= calibrate_time:
-        detections = sv.Detections.from_ultralytics(model(frame,
-                                                          verbose=False)[0])
-        detections = detections[detections.confidence > 0.75]
+    if timestamp is None:
+        timestamp = time.time()
+    elapsed_time = timestamp - start_time
+
+    # stop early once the fused hold map stops changing
+    converged = fusion is not None and fusion.converged and \
+        elapsed_time >= min_calibrate_time
+
+    if elapsed_time <= calibrate_time and not converged:
+        if model is None:
+            model = hold_model.get_model()
+        detections = hold_model.detect_holds(frame, confidence=0.75,
+                                             model=model)
         frame = box_annotator.annotate(scene=image, detections=detections, 
                                        skip_label=True)
 
@@ -25,7 +42,7 @@ def calibrate_holds(start_time, detections, model, frame, box_annotator, image,
 
         print(f"Calibrating... " + " " * 20, end='\r')
 
-        cv2.imshow('Calibrating', frame)  # Update the window
+        display.show('Calibrating', frame)  # Update the window
         # elapsed_time = time.time() - start_time # Update elapsed time
         # Recolor back to BGR
         image.flags.writeable = True
@@ -0,0 +1,130 @@
+# This file will be for:
+# 1. Reading camera frames on their own thread
+# 2. Keeping only the newest frames so the processing loop never lags behind
+# 3. Counting how many frames were dropped on the way
+
+
+import threading
+import time
+from collections import deque
+
+import cv2
+
+
+class ThreadedCapture:
+    """Background frame grabber with a drop-oldest ring buffer.
+
+    Drop in replacement for cv2.VideoCapture in the processing loop: read()
+    always hands back the freshest frame and discards anything older.
+    """
+
+    def __init__(self, source=0, buffer_size=1):
+        """
+        <source>:       a frame_source source, or a camera index or anything
+                        else cv2.VideoCapture accepts
+        <buffer_size>:  number of frames kept in the ring buffer
+        """
+        if hasattr(source, 'read'):
+            self.cap = source
+        else:
+            self.cap = cv2.VideoCapture(source)
+        # Don't let the driver queue up stale frames either
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+        self.ring = deque(maxlen=buffer_size)
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+
+        self.frames_read = 0  # frames grabbed from the camera
+        self.frames_dropped = 0  # frames overwritten before being read
+        self.last_timestamp = None  # capture time of the last frame read
+        self.last_index = -1  # index of the last frame read
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._grab_frames, daemon=True)
+        self.thread.start()
+        return self
+
+    def _grab_frames(self):
+        while self.running:
+            ret, frame = self.cap.read()
+            # Recorded sources know when their frame was taken
+            timestamp = getattr(self.cap, 'last_timestamp', None) or \
+                time.monotonic()
+            with self.condition:
+                if not ret:
+                    self.running = False
+                    self.condition.notify_all()
+                    break
+                if len(self.ring) == self.ring.maxlen:
+                    self.frames_dropped += 1
+                self.ring.append((frame, timestamp, self.frames_read))
+                self.frames_read += 1
+                self.condition.notify_all()
+
+    def read_latest(self, timeout=None):
+        """Wait for a frame newer than the last one read and return
+        (frame, timestamp, index), or None if the capture stopped.
+
+        <timeout>:  seconds to wait at most (None if nothing came), None to
+                    wait as long as the capture thread runs, so a slow
+                    camera or a USB hiccup doesn't end the stream
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while not self.ring:
+                if not self.running or self.thread is None or \
+                        not self.thread.is_alive():
+                    return None
+                wait = 1.0  # wake up now and then to check the thread
+                if deadline is not None:
+                    wait = min(wait, deadline - time.monotonic())
+                    if wait <= 0:
+                        return None
+                self.condition.wait(timeout=wait)
+            frame, timestamp, index = self.ring.pop()
+            # Everything older than the newest frame is stale
+            self.frames_dropped += len(self.ring)
+            self.ring.clear()
+
+        self.last_timestamp = timestamp
+        self.last_index = index
+        return frame, timestamp, index
+
+    def read(self):
+        latest = self.read_latest()
+        if latest is None:
+            return False, None
+        return True, latest[0]
+
+    def isOpened(self):
+        return self.cap.isOpened() and (self.running or bool(self.ring))
+
+    def stats(self):
+        return {"read": self.frames_read, "dropped": self.frames_dropped}
+
+    def release(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+        self.cap.release()
+
+
+def main():
+    print("Testing threaded capture... press q to quit")
+    cap = ThreadedCapture(0).start()
+    while cap.isOpened():
+        ret, frame = cap.read()
+        if not ret:
+            break
+        cv2.imshow('Capture', frame)
+        if cv2.waitKey(10) & 0xFF == ord('q'):
+            break
+    print(cap.stats())
+    cap.release()
+    cv2.destroyAllWindows()
+
+if "__main__" == __name__:
+    main()
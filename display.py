@@ -0,0 +1,43 @@
+# This file will be for:
+# 1. Routing every window the tool opens through one place
+# 2. A headless mode for wall units without a monitor: no GUI calls at all,
+#    frames optionally go to the MJPEG preview instead (see preview.py)
+
+
+import cv2
+
+headless = False
+preview = None  # preview.MjpegPreview, or None
+
+
+def set_headless(enabled=True, preview_port=None, preview_fps=5):
+    """Turn headless mode on, with an MJPEG preview on <preview_port> if
+    given. The preview also works alongside the windows."""
+    global headless, preview
+    headless = enabled
+    if preview_port is not None and preview is None:
+        import preview as mjpeg_preview
+        preview = mjpeg_preview.MjpegPreview(port=preview_port,
+                                             fps=preview_fps).start()
+
+
+def show(window, image):
+    """cv2.imshow, or nothing when headless (the preview gets the frame)"""
+    if preview is not None:
+        preview.submit(image)
+    if not headless:
+        cv2.imshow(window, image)
+
+
+def wait_key(delay=10):
+    """Key pressed during cv2.waitKey(<delay>), -1 when headless"""
+    if headless:
+        return -1
+    return cv2.waitKey(delay) & 0xFF
+
+
+def close():
+    if preview is not None:
+        preview.stop()
+    if not headless:
+        cv2.destroyAllWindows()
@@ -8,6 +8,8 @@ import numpy as np
 import supervision as sv
 import cv2
 from supervision.detection.core import Detections
+
+import display
 COVER_AREA = 0.13 # area that color needs to be cover for the hold to be that color!
 
 # COLOR RANGES IN HSV (Hue, Value, Saturation)
@@ -39,7 +41,91 @@ def calculate_area(coordinates):
     return abs(x2 - x1) * abs(y2 - y1)
 
 
+# Same order as the colour masks, the first colour that covers a hold wins
+COLOUR_RANGES = [
+    ("Red", red_lower, red_upper),
+    ("Orange", orange_lower, orange_upper),
+    ("Yellow", yellow_lower, yellow_upper),
+    ("Green", green_lower, green_upper),
+    ("Blue", blue_lower, blue_upper),
+    ("Pink", pink_lower, pink_upper),
+    ("Purple", purple_lower, purple_upper),
+    ("Black", black_lower, black_upper),
+    ("White", white_lower, white_upper)
+]
+
+# One inRange + findContours pass per colour, only the per box test is
+# vectorised. A flat HSV -> colour lookup table labelling the frame in one
+# pass was tried: on 12 MP photos the lookup alone (~200 ms) costs more than
+# the nine inRange calls (~130 ms), and counting a colour's pixels per box
+# instead of testing single blobs coloured far more holds than the original.
+def colour_blobs(mask):
+    """(area, left, top) of every contour of <mask> as an (n, 3) array, the
+    same contours identify_color_hold goes through"""
+    contours = cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)[0]
+    blobs = np.empty((len(contours), 3), dtype=np.float64)
+    for i, contour in enumerate(contours):
+        blobs[i, 0] = cv2.contourArea(contour)
+        blobs[i, 1:] = cv2.boundingRect(contour)[:2]
+    return blobs
+
+def classify_holds(image, boxes):
+    """Route colour of every box in <boxes> (n, 4), or None if uncoloured.
+
+    Same test as identify_color_hold: a blob of the colour covering at least
+    COVER_AREA of the box, with its top left corner in the box. Each colour's
+    blobs are measured once and checked against every box at once, instead
+    of going through all of them again for every box.
+    """
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    areas = np.abs(boxes[:, 2] - boxes[:, 0]) * np.abs(boxes[:, 3] - boxes[:, 1])
+    x1, y1, x2, y2 = boxes.astype(int).T
+    holds = areas > 300  # area threshold for holds
+
+    colour_names = [None] * len(boxes)
+    if not holds.any():
+        return colour_names
+    hsvFrame = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    for colour_name, lower, upper in COLOUR_RANGES:
+        blobs = colour_blobs(cv2.inRange(hsvFrame, lower, upper))
+        # Blobs too small for even the smallest hold can't cover anything
+        blobs = blobs[blobs[:, 0] >= COVER_AREA * areas[holds].min()]
+        area, left, top = blobs[:, 0, None], blobs[:, 1, None], blobs[:, 2, None]
+        # making sure color is covering enough of the box
+        covered = ((area >= COVER_AREA * areas) & (x1 <= left) & (left <= x2)
+                   & (y1 <= top) & (top <= y2)).any(axis=0) & holds
+        for i in np.flatnonzero(covered):
+            colour_names[i] = colour_name
+        holds &= ~covered  # the first colour that covers a hold wins
+        if not holds.any():
+            break
+    return colour_names
+
 def identify_routes(image, detections):
+    if isinstance(detections, Detections):
+        boxes = detections.xyxy
+    else:
+        boxes = np.array([detection[0] for detection in detections])
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+
+    routes = {}  # The routes
+    for box, colour_name in zip(boxes, classify_holds(image, boxes)):
+        if colour_name is None:
+            # No specific color is detected
+            routes.setdefault("Uncoloured", []).append(box)
+            continue
+        x1, y1, x2, y2 = map(int, box)
+        image = cv2.rectangle(image, (x1, y1), (x2, y2), colours[colour_name], 3)
+        cv2.putText(image, colour_name, (x1, y1), cv2.FONT_HERSHEY_SIMPLEX, 1.0, colours[colour_name])
+        routes.setdefault(colour_name, []).append(box)
+
+    return {color: Detections(np.array(route_boxes))
+            for color, route_boxes in routes.items()}
+
+
+def identify_routes_contours(image, detections):
+    """Original mask and contour based version of identify_routes, kept for
+    benchmarking the vectorised classifier"""
     hsvFrame = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
 
     color_masks = {
@@ -118,8 +204,35 @@ def identify_color_hold(image, contours, detection, colour_name):
                     return detection
     return None
 
-def get_user_route(image, detection_routes):
-    """Go through the dictionary of routes and make sure that get the user's preferred route"""
+def largest_route(detection_routes):
+    """Colour of the route with the most holds, leaving out the Uncoloured
+    leftovers, or None if there's no coloured route"""
+    coloured = [name for name, detections in detection_routes.items()
+                if name != "Uncoloured" and len(detections) > 0]
+    if not coloured:
+        return None
+    return max(coloured, key=lambda name: len(detection_routes[name]))
+
+def get_user_route(image, detection_routes, colour_name=None):
+    """Go through the dictionary of routes and make sure that get the user's preferred route
+
+    <colour_name>:  route to pick without asking, e.g. from the command line.
+                    Headless, nobody can be asked: without it (or if it's not
+                    on the wall) the largest coloured route is picked.
+    """
+    if colour_name is not None and colour_name not in detection_routes:
+        print(f"No {colour_name} route on this wall.")
+        colour_name = None
+    if colour_name is None and display.headless:
+        colour_name = largest_route(detection_routes)
+        if colour_name is None:
+            raise SystemExit("No coloured route found on this wall, "
+                             "nothing to climb.")
+    if colour_name is not None:
+        print(f"Using the {colour_name} route!")
+        b_val, g_val, r_val = colours[colour_name]
+        return detection_routes[colour_name], \
+            sv.Color(b_val, g_val, r_val), colour_name
     user_chose_route = False
     # Display available colors to user
     route_colours = []
@@ -199,6 +312,9 @@ def add_square(event, x, y, flags, param):
 
 def add_detections(image, route_to_update, route_color, colour_name):
     global updated_squares
+    if display.headless:
+        print("Headless, keeping the route without adding holds.")
+        return route_to_update
     print("Do you want to add holds to the route? (yes/no)")
     user_choice = input().lower()
     avg_width, avg_height = map(int, average_detection_size(route_to_update))
@@ -265,6 +381,9 @@ def get_click_point(event, x, y, flags, param):
 
 def remove_detections(image, route_to_update, route_color, colour_name):
     global chosen_route
+    if display.headless:
+        print("Headless, keeping the route without removing holds.")
+        return route_to_update
     print("Do you want to remove holds from the route? (yes/no)")
     user_choice = input().lower()
     avg_width, avg_height = map(int, average_detection_size(route_to_update))
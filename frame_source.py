@@ -0,0 +1,199 @@
+# This file will be for:
+# 1. Giving the pipeline frames from a camera, a video, a folder of images
+#    or a single looping image, all through the same interface
+# 2. Replaying recorded frames faster than realtime for benchmarks and
+#    regression runs on machines without a camera
+
+
+import glob
+import os
+import time
+
+import cv2
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+class FrameSource:
+    """Base frame source, read() matches cv2.VideoCapture.read().
+
+    Recorded sources are paced at <fps> unless <realtime> is False, in which
+    case frames come as fast as they are asked for and last_timestamp is
+    the frame's position in the recording (so runs are deterministic).
+    """
+
+    def __init__(self, fps=30, realtime=True, max_frames=None):
+        """
+        <fps>:          playback rate of recorded frames
+        <realtime>:     sleep between frames to match <fps>
+        <max_frames>:   stop after this many frames (None for no limit)
+        """
+        self.fps = fps
+        self.realtime = realtime
+        self.max_frames = max_frames
+        self.frames_read = 0
+        self.last_timestamp = None
+        self._start_time = None
+        self._opened = True
+
+    def _next_frame(self):
+        raise NotImplementedError
+
+    def read(self):
+        if not self._opened or (self.max_frames is not None
+                                and self.frames_read >= self.max_frames):
+            return False, None
+
+        frame = self._next_frame()
+        if frame is None:
+            self._opened = False
+            return False, None
+
+        if self._start_time is None:
+            self._start_time = time.monotonic()
+        recorded_time = self.frames_read / self.fps
+        if self.realtime:
+            delay = self._start_time + recorded_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.last_timestamp = time.monotonic()
+        else:
+            self.last_timestamp = self._start_time + recorded_time
+
+        self.frames_read += 1
+        return True, frame
+
+    def isOpened(self):
+        return self._opened
+
+    def set(self, prop, value):
+        return False  # recorded sources ignore capture properties
+
+    def stats(self):
+        return {"read": self.frames_read, "dropped": 0}
+
+    def release(self):
+        self._opened = False
+
+
+class CameraSource(FrameSource):
+    """Live camera, always realtime"""
+
+    def __init__(self, index=0, max_frames=None):
+        super().__init__(realtime=True, max_frames=max_frames)
+        self.cap = cv2.VideoCapture(index)
+
+    def read(self):
+        if self.max_frames is not None and self.frames_read >= self.max_frames:
+            return False, None
+        ret, frame = self.cap.read()
+        self.last_timestamp = time.monotonic()
+        if ret:
+            self.frames_read += 1
+        return ret, frame
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def set(self, prop, value):
+        return self.cap.set(prop, value)
+
+    def release(self):
+        self.cap.release()
+
+
+class VideoFileSource(FrameSource):
+    """Recorded video, played at its own frame rate"""
+
+    def __init__(self, path, realtime=True, loop=False, max_frames=None):
+        self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            raise ValueError(f"Could not open video {path}")
+        fps = self.cap.get(cv2.CAP_PROP_FPS) or 30
+        super().__init__(fps=fps, realtime=realtime, max_frames=max_frames)
+        self.loop = loop
+
+    def _next_frame(self):
+        ret, frame = self.cap.read()
+        if not ret and self.loop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.cap.read()
+        return frame if ret else None
+
+    def release(self):
+        super().release()
+        self.cap.release()
+
+
+class ImageGlobSource(FrameSource):
+    """Every image matching a glob pattern (or inside a folder), in order"""
+
+    def __init__(self, pattern, fps=30, realtime=True, loop=False,
+                 max_frames=None):
+        super().__init__(fps=fps, realtime=realtime, max_frames=max_frames)
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*')
+        self.paths = [path for path in sorted(glob.glob(pattern))
+                      if path.lower().endswith(IMAGE_EXTENSIONS)]
+        if not self.paths:
+            raise ValueError(f"No images match {pattern}")
+        self.loop = loop
+        self.position = 0
+
+    def _next_frame(self):
+        # A corrupt or unreadable file is skipped, not the end of the replay
+        for _ in range(len(self.paths)):
+            if self.position >= len(self.paths):
+                if not self.loop:
+                    return None
+                self.position = 0
+            path = self.paths[self.position]
+            self.position += 1
+            frame = cv2.imread(path)
+            if frame is not None:
+                return frame
+            print(f"Skipping unreadable image {path}")
+        return None  # nothing readable left
+
+
+class StillImageSource(FrameSource):
+    """One image repeated forever (or <max_frames> times), decoded once"""
+
+    def __init__(self, path, fps=30, realtime=True, max_frames=None):
+        super().__init__(fps=fps, realtime=realtime, max_frames=max_frames)
+        self.image = cv2.imread(path)
+        if self.image is None:
+            raise ValueError(f"Could not read image {path}")
+
+    def _next_frame(self):
+        # Callers draw on the frame, so each read gets its own copy
+        return self.image.copy()
+
+
+def open_source(spec=0, realtime=True, loop=False, max_frames=None):
+    """Pick the frame source for <spec>:
+    a camera index, a video file, an image, a folder or a glob pattern"""
+    if isinstance(spec, int) or str(spec).isdigit():
+        return CameraSource(int(spec), max_frames=max_frames)
+    if os.path.isdir(spec) or glob.has_magic(spec):
+        return ImageGlobSource(spec, realtime=realtime, loop=loop,
+                               max_frames=max_frames)
+    if spec.lower().endswith(IMAGE_EXTENSIONS):
+        return StillImageSource(spec, realtime=realtime,
+                                max_frames=max_frames)
+    return VideoFileSource(spec, realtime=realtime, loop=loop,
+                           max_frames=max_frames)
+
+
+def main():
+    print("Testing frame sources...")
+    source = open_source('test_images', realtime=False)
+    while source.isOpened():
+        ret, frame = source.read()
+        if not ret:
+            break
+        print(source.frames_read, source.last_timestamp, frame.shape)
+    source.release()
+
+if "__main__" == __name__:
+    main()
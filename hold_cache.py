@@ -0,0 +1,139 @@
+# This file will be for:
+# 1. Fingerprinting the empty wall with a perceptual hash
+# 2. Saving the wall's route map and the manual edits of the chosen route
+# 3. Loading it back on startup so calibration can be skipped, while the
+#    climber can still pick any route on the wall
+
+
+import os
+import time
+
+import cv2
+import numpy as np
+
+CACHE_DIR = 'hold_maps'
+HASH_SIZE = 16  # 16x16 difference hash -> 256 bit fingerprint
+MAX_DISTANCE = 20  # max differing bits for two frames to be the same wall
+
+
+def wall_fingerprint(frame):
+    """Difference hash of a BGR <frame> as a packed uint8 array.
+
+    Each bit says whether a pixel of the blurred, downscaled wall is brighter
+    than its right neighbour, so small lighting and noise changes don't
+    matter but moved holds or a moved camera do.
+    """
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    gray = cv2.GaussianBlur(gray, (5, 5), 0)
+    small = cv2.resize(gray, (HASH_SIZE + 1, HASH_SIZE),
+                       interpolation=cv2.INTER_AREA)
+    return np.packbits(small[:, 1:] > small[:, :-1])
+
+
+def hamming_distance(fingerprint_a, fingerprint_b):
+    return int(np.unpackbits(fingerprint_a ^ fingerprint_b).sum())
+
+
+def _path(fingerprint, cache_dir):
+    return os.path.join(cache_dir, fingerprint.tobytes().hex() + '.npz')
+
+
+def save_routes(fingerprint, routes, colour_name, added=(), removed=(),
+                cache_dir=CACHE_DIR):
+    """Store the route map of the wall with <fingerprint>.
+
+    <routes>:           colour name -> detections (or xyxy boxes) of every
+                        route found during calibration
+    <colour_name>:      the route that was climbed and edited
+    <added>, <removed>: boxes added to and removed from that route by hand
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    names = list(routes)
+    boxes = {f"route_{i}": np.asarray(getattr(routes[name], 'xyxy', routes[name]),
+                                      dtype=np.float32).reshape(-1, 4)
+             for i, name in enumerate(names)}
+    np.savez_compressed(
+        _path(fingerprint, cache_dir),
+        fingerprint=fingerprint,
+        route_names=np.array(names),
+        colour_name=np.array(colour_name),
+        added=np.asarray(added, dtype=np.float32).reshape(-1, 4),
+        removed=np.asarray(removed, dtype=np.float32).reshape(-1, 4),
+        **boxes)
+
+
+def load_routes(fingerprint, cache_dir=CACHE_DIR, max_distance=MAX_DISTANCE):
+    """The cached route map of the closest matching wall, or None.
+
+    Returns a dict with the routes (colour name -> xyxy boxes), the
+    colour_name of the edited route and its manually added and removed
+    boxes. See edited_route() for a route with the edits applied.
+    """
+    if not os.path.isdir(cache_dir):
+        return None
+
+    best_path, best_distance = None, max_distance + 1
+    for name in os.listdir(cache_dir):
+        if not name.endswith('.npz'):
+            continue
+        try:
+            cached = np.frombuffer(bytes.fromhex(name[:-4]), dtype=np.uint8)
+        except ValueError:
+            continue
+        if cached.shape != fingerprint.shape:
+            continue
+        distance = hamming_distance(fingerprint, cached)
+        if distance < best_distance:
+            best_path, best_distance = os.path.join(cache_dir, name), distance
+
+    if best_path is None:
+        return None
+    with np.load(best_path) as data:
+        colour_name = str(data["colour_name"])
+        if "route_names" in data:
+            routes = {str(name): data[f"route_{i}"]
+                      for i, name in enumerate(data["route_names"])}
+            added, removed = data["added"], data["removed"]
+        else:
+            # Older caches only hold the edited route
+            routes = {colour_name: data["xyxy"]}
+            added = removed = np.empty((0, 4), dtype=np.float32)
+        return {"routes": routes,
+                "colour_name": colour_name,
+                "added": added,
+                "removed": removed,
+                "distance": best_distance}
+
+
+def edited_route(cached, colour_name):
+    """xyxy boxes of the <colour_name> route of a load_routes() map, with
+    the manual edits made to it last time"""
+    boxes = cached["routes"][colour_name]
+    if colour_name != cached["colour_name"]:
+        return boxes
+    boxes = np.vstack([boxes, cached["added"]])
+    return box_difference(boxes, cached["removed"])
+
+
+def box_difference(boxes_a, boxes_b):
+    """Boxes of <boxes_a> that are not in <boxes_b>"""
+    boxes_a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    if len(boxes_b) == 0:
+        return boxes_a
+    same = np.all(np.isclose(boxes_a[:, None, :], boxes_b[None, :, :]), axis=2)
+    return boxes_a[~same.any(axis=1)]
+
+
+def main():
+    print("Testing hold cache...")
+    frame = cv2.imread('test_images/test_1.jpg')
+    start_time = time.perf_counter()
+    fingerprint = wall_fingerprint(frame)
+    print(f"Fingerprint in {(time.perf_counter() - start_time) * 1000:.1f} ms")
+    start_time = time.perf_counter()
+    print(load_routes(fingerprint))
+    print(f"Lookup in {(time.perf_counter() - start_time) * 1000:.1f} ms")
+
+if "__main__" == __name__:
+    main()
@@ -0,0 +1,145 @@
+# This file will be for:
+# 1. Merging the hold detections of every calibration frame
+# 2. Voting on the colour of each hold across frames
+# 3. Telling calibration when the hold map has stopped changing
+
+
+import numpy as np
+from supervision.detection.core import Detections
+
+import find_routes
+
+ROUTE_COLOURS = list(find_routes.colours.keys())
+
+
+def box_iou(boxes_a, boxes_b):
+    """IoU between every box in <boxes_a> (n, 4) and <boxes_b> (m, 4) as (n, m)"""
+    boxes_a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+
+    x1 = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    y1 = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    x2 = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    y2 = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return intersection / np.maximum(union, 1e-6)
+
+
+class HoldFusion:
+    """Incremental consensus of the holds seen over the calibration frames.
+
+    Every hold is a track with a running average box, the number of frames
+    it was matched in and one vote per route colour.
+    """
+
+    def __init__(self, iou_threshold=0.5, min_hit_ratio=0.3,
+                 stable_frames=15, stable_shift=2.0):
+        """
+        <iou_threshold>:    minimum IoU for a detection to join a track
+        <min_hit_ratio>:    fraction of frames a track needs to be a hold
+        <stable_frames>:    frames without change before the map converges
+        <stable_shift>:     mean box movement (px) still counted as no change
+        """
+        self.iou_threshold = iou_threshold
+        self.min_hit_ratio = min_hit_ratio
+        self.stable_frames = stable_frames
+        self.stable_shift = stable_shift
+
+        self.boxes = np.empty((0, 4), dtype=np.float32)
+        self.hits = np.empty(0, dtype=np.int32)
+        self.votes = np.empty((0, len(ROUTE_COLOURS)), dtype=np.int32)
+        self.frames = 0
+        self.stable_count = 0
+        self._last_signature = None
+
+    def update(self, routes):
+        """Merge the <routes> of one frame (as returned by identify_routes)"""
+        boxes, labels = [], []
+        for colour_name, detections in routes.items():
+            for detection in detections:
+                boxes.append(detection[0])
+                labels.append(ROUTE_COLOURS.index(colour_name))
+        boxes = np.array(boxes, dtype=np.float32).reshape(-1, 4)
+        labels = np.array(labels, dtype=np.int32)
+
+        self.frames += 1
+        old_boxes = self.boxes.copy()
+        matched = self._match(boxes)
+
+        for det_index, track in enumerate(matched):
+            if track < 0:
+                continue
+            self.hits[track] += 1
+            # Running average of the box coordinates
+            self.boxes[track] += (boxes[det_index] - self.boxes[track]) \
+                / self.hits[track]
+            self.votes[track, labels[det_index]] += 1
+
+        new = matched < 0
+        if np.any(new):
+            votes = np.zeros((int(new.sum()), len(ROUTE_COLOURS)), np.int32)
+            votes[np.arange(len(votes)), labels[new]] = 1
+            self.boxes = np.vstack([self.boxes, boxes[new]])
+            self.hits = np.concatenate([self.hits,
+                                        np.ones(len(votes), np.int32)])
+            self.votes = np.vstack([self.votes, votes])
+
+        self._update_stability(old_boxes)
+
+    def _match(self, boxes):
+        # Greedy matching, best IoU pairs first, one detection per track
+        matched = np.full(len(boxes), -1, dtype=np.int32)
+        if len(boxes) == 0 or len(self.boxes) == 0:
+            return matched
+
+        iou = box_iou(boxes, self.boxes)
+        pairs = np.argwhere(iou >= self.iou_threshold)
+        order = np.argsort(-iou[pairs[:, 0], pairs[:, 1]])
+        used_tracks = set()
+        for det_index, track in pairs[order]:
+            if matched[det_index] >= 0 or track in used_tracks:
+                continue
+            matched[det_index] = track
+            used_tracks.add(track)
+        return matched
+
+    def _confirmed(self):
+        return self.hits >= max(1, self.min_hit_ratio * self.frames)
+
+    def _update_stability(self, old_boxes):
+        confirmed = self._confirmed()
+        signature = (tuple(np.flatnonzero(confirmed)),
+                     tuple(self.votes[confirmed].argmax(axis=1)))
+
+        shift = 0.0
+        old_count = len(old_boxes)
+        kept = np.flatnonzero(confirmed[:old_count])
+        if len(kept):
+            shift = float(np.abs(self.boxes[kept] - old_boxes[kept]).mean())
+
+        if signature == self._last_signature and shift <= self.stable_shift:
+            self.stable_count += 1
+        else:
+            self.stable_count = 0
+        self._last_signature = signature
+
+    @property
+    def converged(self):
+        """True once the consensus map has not changed for stable_frames"""
+        return self.stable_count >= self.stable_frames
+
+    def consensus_routes(self):
+        """The consensus hold map in the same format as identify_routes"""
+        confirmed = self._confirmed()
+        colour_indices = self.votes.argmax(axis=1)
+
+        routes = {}
+        for colour_index, colour_name in enumerate(ROUTE_COLOURS):
+            keep = confirmed & (colour_indices == colour_index)
+            if np.any(keep):
+                routes[colour_name] = Detections(self.boxes[keep].copy())
+        return routes
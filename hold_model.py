@@ -0,0 +1,346 @@
+# This file will be for:
+# 1. Loading the YOLO hold detection model once per process
+# 2. Warming the model up so the first real frame isn't slow
+# 3. Sharing that single instance between calibration, one_img and batch tools
+# 4. Running the model through PyTorch, ONNX Runtime or OpenVINO, in FP32
+#    or INT8, for machines without a GPU
+# 5. Tiled detection so small holds survive on high resolution frames
+
+
+import glob
+import json
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+import supervision as sv
+
+from hold_fusion import box_iou
+
+HOLD_WEIGHTS = 'bestHuge.pt'
+WARMUP_SHAPE = (640, 640, 3)  # dummy frame used for the first inference
+
+# PyTorch is the reference, the others are exported from the same weights
+BACKENDS = ('torch', 'onnx', 'onnx-int8', 'openvino', 'openvino-int8')
+backend = os.environ.get('IRCAT_BACKEND', 'torch')
+# Wall photos the INT8 models are calibrated on
+CALIBRATION_IMAGES = os.environ.get('IRCAT_CALIBRATION_IMAGES', 'test_images')
+CALIBRATION_SAMPLES = 64  # full frames and tiles, at most
+EXPORT_SIZE = 640  # input size of the exported models
+
+# Tiled detection settings, None runs the model on the full frame
+tiling = None
+TILE_SIZE = 640
+TILE_OVERLAP = 0.2  # fraction of a tile shared with its neighbour
+TEXTURE_THRESHOLD = 20.0  # Laplacian variance below this is a blank tile
+
+_models = {}  # (weights path, backend) -> loaded model
+_model_lock = threading.Lock()
+load_times = {}  # (weights path, backend) -> (load seconds, warmup seconds)
+
+
+def set_backend(name):
+    """Choose the backend get_model() uses when none is given"""
+    global backend
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend {name}, expected one of {BACKENDS}")
+    backend = name
+
+
+def get_model(weights=HOLD_WEIGHTS, warmup=True, backend_name=None):
+    """Return the shared YOLO model for <weights>, loading it on first use.
+
+    <weights>:      path to the PyTorch model weights
+    <warmup>:       run one dummy inference right after loading
+    <backend_name>: one of BACKENDS, defaults to the current backend
+    """
+    backend_name = backend_name or backend
+    with _model_lock:
+        model = _models.get((weights, backend_name))
+        if model is None:
+            model = _load_model(weights, backend_name, warmup)
+            _models[(weights, backend_name)] = model
+    return model
+
+
+def _export(weights, path, **kwargs):
+    """Export <weights> with YOLO.export(**kwargs) and move it to <path>"""
+    from ultralytics import YOLO
+    # detect_holds_tiled and detect_holds_batch send several images per
+    # call, a static export only takes a batch of one
+    exported = YOLO(weights).export(dynamic=True, **kwargs)
+    os.replace(exported, path)
+    return path
+
+
+def calibration_images(folder=CALIBRATION_IMAGES):
+    """Calibration inputs from the wall photos in <folder>: every photo and
+    its textured tiles (what detect_holds_tiled sends), BGR"""
+    paths = sorted(glob.glob(os.path.join(folder, '*')))
+    photos, tiles = [], []
+    for path in paths:
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        photos.append(image)
+        for x1, y1, x2, y2 in tile_windows(image.shape):
+            tile = image[y1:y2, x1:x2]
+            if has_texture(tile):
+                tiles.append(tile)
+    if not photos:
+        raise FileNotFoundError(f"no wall photos to calibrate on in {folder}, "
+                                f"set IRCAT_CALIBRATION_IMAGES")
+    # Every photo, and tiles spread over all of them for the rest
+    room = max(0, CALIBRATION_SAMPLES - len(photos))
+    step = max(1, -(-len(tiles) // room)) if room else 0
+    return photos + (tiles[::step][:room] if room else [])
+
+
+def letterbox(image, size=EXPORT_SIZE):
+    """<image> scaled into a <size> square and padded like ultralytics does,
+    as a 1x3xHxW float RGB blob"""
+    height, width = image.shape[:2]
+    scale = size / max(height, width)
+    resized = cv2.resize(image, (round(width * scale), round(height * scale)),
+                         interpolation=cv2.INTER_LINEAR)
+    canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+    top = (size - resized.shape[0]) // 2
+    left = (size - resized.shape[1]) // 2
+    canvas[top:top + resized.shape[0], left:left + resized.shape[1]] = resized
+    blob = canvas[:, :, ::-1].transpose(2, 0, 1)[None].astype(np.float32) / 255
+    return np.ascontiguousarray(blob)
+
+
+def _quantize_onnx(source, path, folder=CALIBRATION_IMAGES):
+    """Static INT8 (QDQ) quantization of the ONNX model <source> into
+    <path>, calibrated on the wall photos in <folder>. Dynamic quantization
+    leaves a YOLO's convolutions in float, static quantization doesn't."""
+    import onnxruntime
+    from onnxruntime.quantization import (CalibrationDataReader, QuantFormat,
+                                          QuantType, quantize_static)
+
+    session = onnxruntime.InferenceSession(
+        source, providers=['CPUExecutionProvider'])
+    input_name = session.get_inputs()[0].name
+    samples = iter(calibration_images(folder))
+
+    class WallPhotos(CalibrationDataReader):
+        def get_next(self):
+            sample = next(samples, None)
+            return None if sample is None else {input_name: letterbox(sample)}
+
+    quantize_static(source, path, WallPhotos(), quant_format=QuantFormat.QDQ,
+                    per_channel=True, activation_type=QuantType.QUInt8,
+                    weight_type=QuantType.QInt8)
+    return path
+
+
+def calibration_dataset(weights, folder=CALIBRATION_IMAGES):
+    """Path of an ultralytics dataset file over the wall photos in <folder>,
+    the data= the OpenVINO INT8 export calibrates on (it would use COCO
+    otherwise)"""
+    from ultralytics import YOLO
+    path = os.path.splitext(weights)[0] + '_calibration.yaml'
+    dataset = {"path": os.path.abspath(folder), "train": ".", "val": ".",
+               "names": YOLO(weights).names}
+    with open(path, 'w') as file:
+        json.dump(dataset, file)  # JSON is valid YAML
+    return path
+
+
+def export_model(weights, backend_name):
+    """Path of the <backend_name> model for <weights>, exporting it if needed"""
+    if backend_name == 'torch':
+        return weights
+
+    # The _dynamic names keep older fixed batch exports from being picked
+    # up, the INT8 names older ones that weren't calibrated on wall photos
+    stem = os.path.splitext(weights)[0]
+    if backend_name == 'onnx':
+        path = stem + '_dynamic.onnx'
+        if not os.path.exists(path):
+            _export(weights, path, format='onnx')
+    elif backend_name == 'onnx-int8':
+        path = stem + '_dynamic_int8_qdq.onnx'
+        if not os.path.exists(path):
+            _quantize_onnx(export_model(weights, 'onnx'), path)
+    elif backend_name == 'openvino':
+        path = stem + '_dynamic_openvino_model'
+        if not os.path.exists(path):
+            _export(weights, path, format='openvino')
+    elif backend_name == 'openvino-int8':
+        path = stem + '_dynamic_int8_wall_openvino_model'
+        if not os.path.exists(path):
+            _export(weights, path, format='openvino', int8=True,
+                    data=calibration_dataset(weights))
+    else:
+        raise ValueError(f"Unknown backend {backend_name}, "
+                         f"expected one of {BACKENDS}")
+    return path
+
+
+def _load_model(weights, backend_name, warmup):
+    # Imported here so modules that only need the helpers below stay light
+    from ultralytics import YOLO
+
+    path = export_model(weights, backend_name)
+    start_time = time.perf_counter()
+    model = YOLO(path, task='detect')
+    load_time = time.perf_counter() - start_time
+
+    warmup_time = 0.0
+    if warmup:
+        start_time = time.perf_counter()
+        model(np.zeros(WARMUP_SHAPE, dtype=np.uint8), verbose=False)
+        warmup_time = time.perf_counter() - start_time
+
+    load_times[(weights, backend_name)] = (load_time, warmup_time)
+    print(f"Loaded {path} ({backend_name}) in {load_time:.2f}s "
+          f"(warmup {warmup_time:.2f}s)")
+    return model
+
+
+def set_tiling(tile_size=TILE_SIZE, overlap=TILE_OVERLAP, skip_flat=True,
+               full_frame=True):
+    """Make detect_holds() tile frames by default (see detect_holds_tiled)"""
+    global tiling
+    tiling = {"tile_size": tile_size, "overlap": overlap,
+              "skip_flat": skip_flat, "full_frame": full_frame}
+
+
+def detect_holds(frame, confidence=0.5, model=None, tiled=None):
+    """Run the hold detector on <frame> and keep detections above <confidence>
+
+    <tiled>:    True/False to force tiling on or off, None follows set_tiling()
+    """
+    if model is None:
+        model = get_model()
+    if tiled or (tiled is None and tiling is not None):
+        return detect_holds_tiled(frame, confidence, model, **(tiling or {}))
+    detections = sv.Detections.from_ultralytics(model(frame, verbose=False)[0])
+    return detections[detections.confidence > confidence]
+
+
+def detect_holds_batch(frames, confidence=0.5, model=None):
+    """detect_holds() over a list of frames in one model call per batch"""
+    if model is None:
+        model = get_model()
+    if tiling is not None:
+        # tiles are already batched within each frame
+        return [detect_holds(frame, confidence, model) for frame in frames]
+    batch = []
+    for result in model(list(frames), verbose=False):
+        detections = sv.Detections.from_ultralytics(result)
+        batch.append(detections[detections.confidence > confidence])
+    return batch
+
+
+def tile_windows(shape, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    """(x1, y1, x2, y2) of overlapping tiles covering an image of <shape>"""
+    height, width = shape[:2]
+    stride = max(1, int(tile_size * (1 - overlap)))
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size, stride))
+        return positions + [length - tile_size]  # last tile flush with edge
+
+    return [(x, y, min(x + tile_size, width), min(y + tile_size, height))
+            for y in starts(height) for x in starts(width)]
+
+
+def has_texture(tile, threshold=TEXTURE_THRESHOLD):
+    """False for blank tiles (sky, mats, plain wall) with nothing to detect"""
+    gray = cv2.cvtColor(tile, cv2.COLOR_BGR2GRAY)
+    gray = cv2.resize(gray, (128, 128), interpolation=cv2.INTER_AREA)
+    return cv2.Laplacian(gray, cv2.CV_32F).var() >= threshold
+
+
+def non_max_suppression(boxes, scores, iou_threshold=0.5,
+                        containment_threshold=0.8):
+    """Indices of the boxes to keep, best score first.
+
+    A box is dropped if it overlaps a better one by <iou_threshold> IoU, or
+    if <containment_threshold> of it lies inside a better one, which is what
+    a hold cut in half by a tile edge looks like.
+    """
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    order = np.argsort(-np.asarray(scores))
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+
+    keep = []
+    while len(order):
+        best, rest = order[0], order[1:]
+        keep.append(best)
+        iou = box_iou(boxes[best], boxes[rest])[0]
+        union = areas[best] + areas[rest]
+        intersection = iou * union / (1 + iou)
+        contained = intersection / np.maximum(np.minimum(areas[best],
+                                                         areas[rest]), 1e-6)
+        order = rest[(iou < iou_threshold) & (contained < containment_threshold)]
+    return np.array(keep, dtype=int)
+
+
+tile_stats = {"run": 0, "skipped": 0}  # tiles of the last tiled frame
+
+
+def detect_holds_tiled(frame, confidence=0.5, model=None,
+                       tile_size=TILE_SIZE, overlap=TILE_OVERLAP,
+                       skip_flat=True, full_frame=True, iou_threshold=0.5):
+    """Detect holds on overlapping tiles of <frame> at full resolution.
+
+    <tile_size>:    tile width and height in pixels
+    <overlap>:      fraction of each tile shared with its neighbours
+    <skip_flat>:    don't run the model on tiles without wall texture
+    <full_frame>:   also run on the whole (downscaled) frame so holds larger
+                    than a tile are still found
+    """
+    if model is None:
+        model = get_model()
+
+    windows = tile_windows(frame.shape, tile_size, overlap)
+    if skip_flat:
+        textured = [window for window in windows
+                    if has_texture(frame[window[1]:window[3],
+                                         window[0]:window[2]])]
+    else:
+        textured = windows
+    tile_stats["run"] = len(textured)
+    tile_stats["skipped"] = len(windows) - len(textured)
+
+    crops = [frame[y1:y2, x1:x2] for x1, y1, x2, y2 in textured]
+    offsets = [(x1, y1, x1, y1) for x1, y1, _, _ in textured]
+    if full_frame:
+        crops.append(frame)
+        offsets.append((0, 0, 0, 0))
+    if not crops:
+        return sv.Detections.empty()
+
+    # All tiles go through the model as one batch
+    results = model(crops, verbose=False)
+    parts = []
+    for result, offset in zip(results, offsets):
+        detections = sv.Detections.from_ultralytics(result)
+        detections = detections[detections.confidence > confidence]
+        if len(detections):
+            detections.xyxy = detections.xyxy + np.array(offset, np.float32)
+            parts.append(detections)
+    if not parts:
+        return sv.Detections.empty()
+
+    merged = sv.Detections.merge(parts)
+    keep = non_max_suppression(merged.xyxy, merged.confidence, iou_threshold)
+    return merged[keep]
+
+
+def main():
+    print("Testing hold model...")
+    get_model()
+    get_model()  # second call must not reload
+    print(load_times)
+
+if "__main__" == __name__:
+    main()
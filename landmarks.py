@@ -0,0 +1,74 @@
+# This file will be for:
+# 1. Converting MediaPipe's pose landmarks into one (33, 4) float32 array
+# 2. Computing the centroid of every limb in a single vectorized operation
+# 3. Drawing the pose straight from that array
+
+
+import cv2
+import numpy as np
+
+NUM_LANDMARKS = 33  # MediaPipe pose landmarks
+
+# Ordered so the limb selected with main's HAND_FOOT / RIGHT_LEFT is
+# LIMBS[2 * HAND_FOOT + RIGHT_LEFT]
+LIMBS = ["right_hand", "left_hand", "right_foot", "left_foot"]
+
+# MediaPipe landmark indices of each limb (see read_me_imgs/landmarks.png)
+LIMB_LANDMARKS = {
+    "right_hand": [18, 20, 22, 16],  # pinky, index, thumb, wrist
+    "left_hand": [17, 19, 21, 15],
+    "right_foot": [28, 30, 32],  # ankle, heel, foot index
+    "left_foot": [27, 29, 31],
+}
+
+# Row i averages the landmarks of LIMBS[i], so all centroids are one matmul
+LIMB_WEIGHTS = np.zeros((len(LIMBS), NUM_LANDMARKS), dtype=np.float32)
+for _limb, _indices in enumerate(LIMB_LANDMARKS[name] for name in LIMBS):
+    LIMB_WEIGHTS[_limb, _indices] = 1.0 / len(_indices)
+
+
+def limb_index(hand_foot, right_left):
+    """Row of LIMBS for the HAND_FOOT / RIGHT_LEFT selection"""
+    return 2 * hand_foot + right_left
+
+
+def to_array(landmark_list, out=None):
+    """(33, 4) x, y, z, visibility array of a MediaPipe landmark list.
+
+    <out>:  preallocated float32 array to fill instead of a new one
+    """
+    if out is None:
+        out = np.empty((NUM_LANDMARKS, 4), dtype=np.float32)
+    out[:] = [(landmark.x, landmark.y, landmark.z, landmark.visibility)
+              for landmark in landmark_list]
+    return out
+
+
+def limb_centroids(landmarks, frame_shape):
+    """(4, 2) pixel centroid of every limb in LIMBS"""
+    scale = np.array([frame_shape[1], frame_shape[0]], dtype=np.float32)
+    return (LIMB_WEIGHTS @ landmarks[:, :2]) * scale
+
+
+def limb_polygon(landmarks, limb, frame_shape):
+    """int32 pixel points of <limb>'s landmarks, for drawing"""
+    scale = np.array([frame_shape[1], frame_shape[0]], dtype=np.float32)
+    return (landmarks[LIMB_LANDMARKS[limb], :2] * scale).astype(np.int32)
+
+
+def draw_pose(image, landmarks, connections, min_visibility=0.5,
+              point_colour=(245, 117, 66), line_colour=(245, 66, 230)):
+    """Draw the skeleton of <landmarks> on <image>, the array version of
+    mp_drawing.draw_landmarks.
+
+    <connections>:  pairs of landmark indices, e.g. mp_pose.POSE_CONNECTIONS
+    """
+    scale = np.array([image.shape[1], image.shape[0]], dtype=np.float32)
+    points = (landmarks[:, :2] * scale).astype(np.int32)
+    visible = landmarks[:, 3] >= min_visibility
+    for start, end in connections:
+        if visible[start] and visible[end]:
+            cv2.line(image, tuple(points[start]), tuple(points[end]),
+                     line_colour, 2)
+    for point in points[visible]:
+        cv2.circle(image, tuple(point), 2, point_colour, 2)
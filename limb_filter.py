@@ -0,0 +1,142 @@
+# This file will be for:
+# 1. Smoothing the jitter out of the limb positions with a One-Euro filter
+# 2. Predicting where each limb will be a few milliseconds ahead, so the
+#    distance played to the climber isn't already stale when they hear it
+# 3. Matching that prediction to the measured capture -> guidance latency
+
+
+import math
+
+import numpy as np
+
+
+class OneEuroFilter:
+    """One-Euro filter (Casiez et al. 2012) over an (n, d) array of points.
+
+    A low-pass filter whose cutoff rises with speed: slow movements are
+    smoothed a lot (no jitter), fast ones barely (no lag). Each row is one
+    point, its speed is the norm of the row's velocity.
+    """
+
+    def __init__(self, min_cutoff=0.5, beta=0.05, d_cutoff=1.0):
+        """
+        <min_cutoff>:   cutoff (Hz) when still, lower means smoother
+        <beta>:         cutoff increase per px/s of speed, higher means less lag
+        <d_cutoff>:     cutoff (Hz) of the velocity estimate
+        """
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.reset()
+
+    def reset(self):
+        self.value = None     # filtered points
+        self.velocity = None  # filtered velocity, units per second
+        self.timestamp = None
+
+    @staticmethod
+    def alpha(cutoff, dt):
+        tau = 1.0 / (2 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def __call__(self, points, timestamp):
+        """Filtered <points> at <timestamp> (seconds)"""
+        points = np.asarray(points, dtype=np.float32)
+        if self.value is None or timestamp <= self.timestamp:
+            if self.value is None:
+                self.value = points.copy()
+                self.velocity = np.zeros_like(points)
+            self.timestamp = timestamp
+            return self.value
+
+        dt = timestamp - self.timestamp
+        velocity = (points - self.value) / dt
+        self.velocity += self.alpha(self.d_cutoff, dt) * \
+            (velocity - self.velocity)
+
+        speed = np.linalg.norm(self.velocity, axis=-1, keepdims=True)
+        cutoff = self.min_cutoff + self.beta * speed
+        tau = 1.0 / (2 * math.pi * cutoff)
+        self.value += (points - self.value) / (1.0 + tau / dt)
+        self.timestamp = timestamp
+        return self.value
+
+
+class LimbFilter:
+    """Smooths the (4, 2) limb centroids of every frame and predicts them
+    <lead> seconds ahead.
+
+    With predict_ms=None the lead follows the measured latency from frame
+    capture to guidance (plus <output_ms> for the sound to come out), so the
+    prediction lands when the climber hears it.
+
+    The One-Euro derivative is too noisy to extrapolate with, its jitter
+    grows with the lead. The prediction uses a second, slower low-pass of
+    it, and its gain shrinks as the lead grows.
+    """
+
+    def __init__(self, min_cutoff=0.5, beta=0.05, d_cutoff=1.0,
+                 predict_ms=None, output_ms=50.0, max_lead_ms=250.0,
+                 max_gap=0.5, velocity_cutoff=2.0, lead_damping=0.2):
+        """
+        <predict_ms>:       fixed prediction horizon, None to match the
+                            latency
+        <output_ms>:        latency after guidance (audio output) added to
+                            the measured one
+        <max_lead_ms>:      cap on the prediction, velocity errors grow with it
+        <max_gap>:          seconds without a pose before the filter restarts
+        <velocity_cutoff>:  cutoff (Hz) of the velocity the prediction uses
+        <lead_damping>:     seconds, the extrapolation gain is
+                            lead_damping / (lead_damping + lead)
+        """
+        self.filter = OneEuroFilter(min_cutoff, beta, d_cutoff)
+        self.predict_ms = predict_ms
+        self.output_ms = output_ms
+        self.max_lead_ms = max_lead_ms
+        self.max_gap = max_gap
+        self.velocity_cutoff = velocity_cutoff
+        self.lead_damping = lead_damping
+        self.velocity = None  # smoothed velocity for the prediction
+        self.latency = None  # smoothed capture -> guidance latency, seconds
+
+    @property
+    def filtered(self):
+        return self.filter.value
+
+    def lead(self):
+        """Prediction horizon in seconds"""
+        if self.predict_ms is not None:
+            lead_ms = self.predict_ms
+        else:
+            lead_ms = self.output_ms + 1000 * (self.latency or 0.0)
+        return min(lead_ms, self.max_lead_ms) / 1000
+
+    def measure(self, latency):
+        """Add one capture -> guidance latency sample (seconds)"""
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += 0.1 * (latency - self.latency)
+
+    def update(self, points, timestamp, latency=None):
+        """Predicted limb positions for the frame captured at <timestamp>.
+
+        <latency>:  seconds from the frame's capture until now, if known
+        """
+        if latency is not None:
+            self.measure(latency)
+        if self.filter.timestamp is not None and \
+                timestamp - self.filter.timestamp > self.max_gap:
+            self.filter.reset()  # lost the climber, don't predict from stale motion
+        previous = self.filter.timestamp
+        filtered = self.filter(points, timestamp)
+        if previous is None:
+            self.velocity = np.zeros_like(filtered)
+        elif timestamp > previous:
+            self.velocity += OneEuroFilter.alpha(
+                self.velocity_cutoff, timestamp - previous) * \
+                (self.filter.velocity - self.velocity)
+
+        lead = self.lead()
+        gain = self.lead_damping / (self.lead_damping + lead)
+        return filtered + self.velocity * (gain * lead)
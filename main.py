@@ -1,30 +1,37 @@
+import time
+IMPORT_START = time.perf_counter()  # for the startup report
+
 import cv2
 import mediapipe as mp
 import numpy as np
 mp_drawing = mp.solutions.drawing_utils
 mp_pose = mp.solutions.pose
 
-from ultralytics import YOLO
 import supervision as sv
 
-from queue import Queue
+import argparse
 import threading
-import time
 
 import calibrate
+import capture
+import display
 import find_routes
+import frame_source
+import hold_cache
+import hold_fusion
+import hold_model
+import landmarks
+import limb_filter
+import overlay
+import pipeline
+import pose_tracker
+import route_state
 import audio_feedback
 import audio_input
-import time
 
-from pynput import keyboard
+IMPORT_TIME = time.perf_counter() - IMPORT_START
 
 # Defining global variables
-R_FOOT = ["right_ankle", "right_heel", "right_foot_index"]
-L_FOOT = ["left_ankle", "left_heel", "left_foot_index"]
-R_HAND = ["right_pinky", "right_index", "right_thumb", "right_wrist"]
-L_HAND = ["left_pinky", "left_index", "left_thumb", "left_wrist"]
-
 HAND_FOOT = 0
 RIGHT_LEFT = 0
 
@@ -56,22 +63,6 @@ def on_press(key):
     except AttributeError:
         pass  # Handle special keys here if needed
 
-def check_grab_hold(limb, hold, grabbed_areas, GRAB_THRESHOLD):
-    start_time = time.time()
-
-    while time.time() - start_time < 3:
-        current_distance = get_relative_distance(limb, hold)
-        if current_distance > GRAB_THRESHOLD:
-            return  # Exit the function if the distance exceeds the threshold
-
-        time.sleep(0.1)
-
-    # If the loop completes, it means the hold is grabbed
-    with limb_lock:  # Use lock for thread safety
-        if not is_exact_detection_in_list(hold, grabbed_areas):
-            grabbed_areas.append(hold)
-            # audio_feedback.calibrated_sound()
-
 def calculate_angle(a,b,c):
     # First, Mid, End
     a, b, c = np.array(a), np.array(b), np.array(c)
@@ -91,9 +82,7 @@ def display_hand(image, hand_pts):
     center_3d = np.mean(hand_pts, axis=0)
     # Calculate the radius of the circle in 3D space based on the average 
     # distance from the center to each point
-    distances = [np.linalg.norm([p[0] - center_3d[0], 
-                                 p[1] - center_3d[1], 
-                                 p[2] - center_3d[2]]) for p in hand_pts]
+    distances = np.linalg.norm(hand_pts - center_3d, axis=1)
 
     scaling_factor = 3  # scaling factor must be int
     radius_3d = scaling_factor * int(sum(distances) / len(distances))
@@ -102,21 +91,6 @@ def display_hand(image, hand_pts):
     cv2.circle(image, (int(center_3d[0]), int(center_3d[1])), radius_3d, 
                (245, 117, 66), thickness=-1)
 
-def foot_pts(ankle, heel, index, frame_shape_1, frame_shape_0):
-    return np.array([
-        [int(ankle.x * frame_shape_1), int(ankle.y * frame_shape_0)],
-        [int(heel.x * frame_shape_1), int(heel.y * frame_shape_0)],
-        [int(index.x * frame_shape_1), int(index.y * frame_shape_0)]
-        ], np.int32)
-
-def hand_pts(pinky, index, thumb, wrist, frame_shape_1, frame_shape_0):
-    return np.array([
-        [int(pinky.x * frame_shape_1), int(pinky.y * frame_shape_0)],
-        [int(index.x * frame_shape_1), int(index.y * frame_shape_0)],
-        [int(thumb.x * frame_shape_1), int(thumb.y * frame_shape_0)],
-        [int(wrist.x * frame_shape_1), int(wrist.y * frame_shape_0)]
-        ], np.int32)
-
 def display_coords(d):
     max_key_length = max(len(key) for key in d.keys())
     max_x_length = max(len(str(value.x)) for value in d.values())
@@ -147,42 +121,6 @@ def get_curr_position(d, detections):
                 # save the coordinates
                 pass
 
-def find_closest_hold(hand_point, detections, grabbed_areas):
-    closest_detection = None
-    min_distance = float('inf')
-    print(f"Detections: {detections}\n", end='\r')
-    # print(f"Grabbed areas: {grabbed_areas}\n", end='\r')
-    for detection in detections:
-        if is_exact_detection_in_list(detection, grabbed_areas):
-            continue
-
-        distance = get_relative_distance(hand_point, detection)
-        if distance < min_distance:
-            min_distance = distance
-            closest_detection = detection
-    return closest_detection
-
-def is_exact_detection_in_list(target_detection, detection_list):
-    for detection in detection_list:
-        # Assuming each detection is structured as [rock_hold_pos, ...]
-        det_coords = detection[0]  # Extract coordinates of the detection
-        target_coords = target_detection[0]  # Extract coordinates of the target detection
-        if np.array_equal(det_coords, target_coords):
-            return True
-    return False
-
-def get_center_point(d, limb, right_foot_pts, left_foot_pts, right_hand_pts,
-                     left_hand_pts):
-    if limb in R_FOOT:
-        return np.mean(right_foot_pts, axis=0)
-    elif limb in L_FOOT:
-        return np.mean(left_foot_pts, axis=0)
-    elif limb in R_HAND:
-        return np.mean(right_hand_pts, axis=0)
-    elif limb in L_HAND:
-        return np.mean(left_hand_pts, axis=0)
-    return np.array([d[limb].x, d[limb].y], np.int32)
-
 def get_relative_distance(center_limb_pt, rock_hold):
     # points of rock_hold
     rock_hold_pos = rock_hold[0]
@@ -194,11 +132,11 @@ def get_relative_distance(center_limb_pt, rock_hold):
     # print("C:", center_limb_pt[:2])
     return np.linalg.norm(abs(center_limb_pt[:2] - mean_rock_coord))
 
-def audio_feedback_manager(audio_queue):
-    while True:
-        distance = audio_queue.get()
-        audio_feedback.play_distance(distance)
-        audio_queue.task_done()
+def audio_feedback_manager(scheduler):
+    """Beep the newest distance, at a rate set by the distance
+    (audio_feedback.FeedbackScheduler), whatever the vision frame rate"""
+    scheduler.run()
+    print(f"Audio feedback: {scheduler.stats()}")
 
 def audio_input_manager():
     global HAND_FOOT
@@ -206,295 +144,387 @@ def audio_input_manager():
 
     while True:
         print("Here")
-        new_hf, new_rl = audio_input.input_audio()
+        try:
+            new_hf, new_rl = audio_input.input_audio()
+        except Exception as error:
+            # e.g. no microphone, keep the limb and try again
+            print(f"Audio input failed: {type(error).__name__}: {error}")
+            time.sleep(1.0)
+            continue
         if new_hf != -1 and new_rl != -1:
             HAND_FOOT, RIGHT_LEFT = new_hf, new_rl
         print("TESTING:", HAND_FOOT, RIGHT_LEFT)
 
+def track_climb(cap, pose, route, route_color, audio_queue, dwell_tracker,
+                realtime=True, pose_roi=False, limb_smoother=None,
+                record_limbs=None, show=True):
+    """Guide the climber up <route>, with capture, pose estimation, guidance
+    and rendering running as overlapping pipeline stages.
+
+    With <realtime> the stages only ever work on the freshest frame,
+    otherwise every frame goes through (for deterministic replays).
+    <limb_smoother> smooths the limb positions and predicts them ahead for the
+    audio, <record_limbs> is an .npz path to save the raw ones to. Without
+    <show> nothing is drawn, the last stage just drops the frames.
+    """
+    if limb_smoother is None:
+        limb_smoother = limb_filter.LimbFilter()
+    recorded_limbs = []  # (timestamp, (4, 2) limb points) per frame
+    # Preallocated landmark arrays, cycled so the frames still in flight in
+    # the pipeline never share one
+    landmark_buffers = [np.empty((landmarks.NUM_LANDMARKS, 4), np.float32)
+                        for _ in range(16)]
+    frame_index = 0
+
+    def read_frame():
+        if not cap.isOpened():
+            return pipeline.STOP
+        ret, frame = cap.read() # always the freshest frame
+        if not ret:
+            return pipeline.STOP
+        return {"frame": frame, "timestamp": cap.last_timestamp}
+
+    def estimate_pose(packet):
+        nonlocal frame_index
+        # Recolor image to RGB
+        image = cv2.cvtColor(packet["frame"], cv2.COLOR_BGR2RGB)
+        image.flags.writeable = False
+
+        # Make detection
+        buffer = landmark_buffers[frame_index % len(landmark_buffers)]
+        frame_index += 1
+        if tracker is not None:
+            pose_array = tracker.process(image, out=buffer)
+        else:
+            results = pose.process(image)
+            # One copy out of MediaPipe, then everything is array maths
+            pose_array = None if results.pose_landmarks is None else \
+                landmarks.to_array(results.pose_landmarks.landmark, out=buffer)
+
+        packet["landmarks"] = pose_array
+        packet["limb_points"] = None if pose_array is None else \
+            landmarks.limb_centroids(pose_array, packet["frame"].shape)
+        return packet
+
+    def guide(packet):
+        global TARGET_HOLD
+        limb_points = packet["limb_points"]
+        if limb_points is None:
+            return packet
+
+        if record_limbs is not None:
+            recorded_limbs.append((packet["timestamp"], limb_points.copy()))
+
+        # Smoothed centroids for the grab, predicted ones for the audio so
+        # the distance is current by the time it plays
+        latency = time.monotonic() - packet["timestamp"] if realtime else None
+        predicted = limb_smoother.update(limb_points, packet["timestamp"],
+                                       latency)
+        selected = landmarks.limb_index(HAND_FOOT, RIGHT_LEFT)
+        limb = limb_smoother.filtered[selected]
+
+        if TARGET_HOLD is not None:
+            distance = route.distance(predicted[selected], TARGET_HOLD)
+            # every frame, the audio side decides when to beep. Stamped with
+            # the capture time, so its age includes the pipeline's latency
+            audio_queue.put(distance, packet["timestamp"]
+                            if realtime else None)
+
+        print("--------------------\n", end='\r')
+        print(f"{landmarks.LIMBS[selected]} selected\n", end='\r')
+
+        # Find the closest hold that hasn't been grabbed yet
+        next_target_hold = route.nearest_unvisited(limb)
+        TARGET_HOLD = next_target_hold
+
+        if next_target_hold is None:
+            print("All holds of the route grabbed!\n", end='\r')
+        else:
+            print(f"Next target hold: {route.box(next_target_hold)}\n", end='\r')
+            print(f"Grabbed areas: {route.xyxy[route.grabbed]}\n", end='\r')
+
+            distance_to_next_hold = route.distance(limb, next_target_hold)
+            print(f"Distance to next hold: {distance_to_next_hold} units\n", end='\r')
+
+        # Advance the selected limb's dwell with this frame's time
+        if dwell_tracker.update((HAND_FOOT, RIGHT_LEFT), limb, TARGET_HOLD,
+                                route, packet["timestamp"]):
+            print("Hold grabbed!\n", end='\r')
+
+        print("--------------------\n", end='\r')
+        return packet
+
+    # route_color was made from a BGR tuple, so its "RGB" is the BGR colour
+    route_overlay = overlay.RouteOverlay(route, route_color.as_rgb())
+
+    def render(packet):
+        pose_array = packet["landmarks"]
+        image = packet["frame"]  # drawn on in place, nothing reads it after
+
+        # the selected route's holds, drawn once and cached between frames
+        route_overlay.apply(image)
+
+        if pose_array is not None:
+            shape = image.shape
+            for foot in ("right_foot", "left_foot"):
+                cv2.fillPoly(image, [landmarks.limb_polygon(pose_array, foot, shape)],
+                             (245, 117, 66))
+            for hand in ("right_hand", "left_hand"):
+                display_hand(image, landmarks.limb_polygon(pose_array, hand, shape))
+
+            # Render detections, on top of the limbs
+            landmarks.draw_pose(image, pose_array, mp_pose.POSE_CONNECTIONS)
+
+        display.show('Pose Detection', image)
+
+        if display.wait_key(10) == ord('q'):
+            return pipeline.STOP
+        return packet
+
+    # Live runs only keep the freshest item between stages, replays keep all
+    frames = pipeline.Channel(maxsize=1, latest=realtime)
+    poses = pipeline.Channel(maxsize=2, latest=False)
+    guided = pipeline.Channel(maxsize=1, latest=realtime)
+    # Pose on a crop around the climber, see pose_tracker.py
+    tracker = pose_tracker.RoiPoseTracker(pose) if pose_roi else None
+
+    runtime = pipeline.Pipeline([
+        pipeline.Stage("capture", read_frame, outbox=frames),
+        pipeline.Stage("pose", estimate_pose, inbox=frames, outbox=poses),
+        pipeline.Stage("guidance", guide, inbox=poses, outbox=guided),
+        pipeline.Stage("render", render if show else lambda packet: packet,
+                       inbox=guided)]).start()
+
+    try:
+        while runtime.step():
+            pass
+    finally:
+        runtime.stop()
+        runtime.report()
+        if tracker is not None:
+            print(f"Pose ROI stats: {tracker.stats}")
+        print(f"Limb prediction lead: {limb_smoother.lead() * 1000:.0f} ms")
+        print(f"Distance channel: {audio_queue.stats()}")
+        if record_limbs is not None and recorded_limbs:
+            timestamps, points = zip(*recorded_limbs)
+            np.savez(record_limbs, timestamps=np.array(timestamps),
+                     points=np.stack(points))
+            print(f"Saved {len(points)} frames of limb positions to {record_limbs}")
+
 # def pose_est_hold_detect():
-def pose_est_hold_detect(audio_queue):
+def pose_est_hold_detect(audio_queue, source=None, use_cache=True,
+                         dwell_time=3.0, grab_radius=100, pose_roi=False,
+                         limb_smoother=None, record_limbs=None, show=True,
+                         route_colour=None):
     global HAND_FOOT
     global RIGHT_LEFT
     global TARGET_HOLD
 
     # JUST THE POSE
     global selected_limb
-    cap = cv2.VideoCapture(0)
-
-    model = YOLO('bestHuge.pt')
+    if source is None:
+        source = frame_source.open_source(0)
+    if source.realtime:
+        cap = capture.ThreadedCapture(source).start()
+    else:
+        cap = source  # replaying as fast as possible, keep every frame
+
+    model = None # only loaded if the wall isn't in the hold map cache
     # box_annotator = sv.BoxAnnotator(thickness=2, text_thickness=2, text_scale=1)
     dark_grey= sv.Color(64, 64, 64)
     box_annotator = sv.BoxAnnotator(color=dark_grey, thickness=2,
                                     text_thickness=2, text_scale=1)
     detections = []
-    next_target_hold = None
-    grabbed_areas = []  # List to store the coordinates of grabbed holds
+    route = None  # route_state.RouteState of the selected route
     GRAB_AREA_THRESHOLD = 50  # Define a proximity threshold
-    GRAB_THRESHOLD = 100  # How far away does the hand need to be to constitute a grab
+    GRAB_THRESHOLD = grab_radius  # How far away does the hand need to be to constitute a grab
+    # Frame driven grab detection, one dwell per limb
+    dwell_tracker = route_state.DwellTracker(dwell_time=dwell_time,
+                                             radius=GRAB_THRESHOLD)
 
     ## Setup mediapipe instance
     with mp_pose.Pose(min_detection_confidence=0.8,
                       min_tracking_confidence=0.8) as pose:
-        start_time = time.time()
+        start_time = None  # timestamp of the first calibration frame
         calibrated = False # Keeps track if you are at calibration phrase
 
-        frame_counter = 0
         routes = {}
+        fusion = hold_fusion.HoldFusion()
+        wall_fingerprint = None
         while cap.isOpened():
-            ret, frame = cap.read()
-            # frame = cv2.imread('test_images/test_1.jpg') # for testing specific images
+            ret, frame = cap.read() # always the freshest frame
+            if not ret:
+                break
+
+            if wall_fingerprint is None:
+                # First frame is the empty wall, look it up in the cache
+                wall_fingerprint = hold_cache.wall_fingerprint(frame)
+                cached = hold_cache.load_routes(wall_fingerprint) \
+                    if use_cache else None
+                if cached is not None and route_colour is not None and \
+                        route_colour not in cached["routes"]:
+                    print(f"No {route_colour} route in the cached hold map, "
+                          f"recalibrating.")
+                    cached = None
+                if cached is not None:
+                    print("Loaded the cached hold map, skipping calibration!")
+                    routes = {name: sv.Detections(xyxy)
+                              for name, xyxy in cached["routes"].items()}
+                    # Any route on the wall can still be picked
+                    _, route_color, colour_name = find_routes.get_user_route(
+                        frame.copy(), routes, route_colour)
+                    selected_route = sv.Detections(
+                        hold_cache.edited_route(cached, colour_name))
+                    audio_feedback.calibrated_sound()
+                    detections = selected_route
+                    route = route_state.RouteState(selected_route)
+                    calibrated = True
+                else:
+                    model = hold_model.get_model()
+                    # don't count the model load, calibration starts with
+                    # the next frame
+                    continue
 
             image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
             image.flags.writeable = False
 
             if not calibrated:
+                # Timed on the source's clock, so --fast replays are
+                # deterministic
+                if start_time is None:
+                    start_time = cap.last_timestamp
                 detections, frame, image, calibrated = \
                     calibrate.calibrate_holds(start_time, detections, model,
                                               frame, box_annotator, image,
-                                              calibrated)
-                find_routes.identify_routes(image, detections)
-                temp_routes = find_routes.identify_routes(image, detections)
-                if len(temp_routes) > len(routes): # get the max amount of routes
-                    routes = temp_routes
+                                              calibrated, fusion,
+                                              cap.last_timestamp)
+                if not calibrated:
+                    # merge this frame's holds into the consensus map
+                    temp_routes = find_routes.identify_routes(image, detections)
+                    fusion.update(temp_routes)
                 if calibrated:
-                    selected_route, route_color, colour_name = find_routes.get_user_route(image,routes)
+                    routes = fusion.consensus_routes()
+                    # headless, get_user_route picks the largest coloured route
+                    selected_route, route_color, colour_name = find_routes.get_user_route(image,routes,route_colour)
+                    proposed_holds = selected_route.xyxy
                     image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
                     selected_route = find_routes.add_detections(frame, selected_route, route_color, colour_name)
+                    edited_holds = selected_route.xyxy
                     image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
                     selected_route = find_routes.remove_detections(frame, selected_route, route_color, colour_name)
+                    # Remember this wall so next session can skip calibration
+                    hold_cache.save_routes(
+                        wall_fingerprint, routes, colour_name,
+                        added=hold_cache.box_difference(edited_holds, proposed_holds),
+                        removed=hold_cache.box_difference(edited_holds, selected_route.xyxy))
                     # print(selected_route) 
                     audio_feedback.calibrated_sound()
                     detections = selected_route # UPDATE DETECTIONS WITH FINAL ROUTE
+                    route = route_state.RouteState(selected_route)
 
-            else:
-                # Recolor image to RGB
-                image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                image.flags.writeable = False
+            if calibrated:
+                break # tracking runs as a pipeline from here on
 
-                # Make detection
-                results = pose.process(image)
+            display.show('Pose Detection', image)
 
-                # annotate the scene with the selected route's detections
-                box_annotator = sv.BoxAnnotator(color=route_color, thickness=3,
-                                    text_thickness=2, text_scale=1)
-                frame = box_annotator.annotate(scene=image,
-                                               detections=selected_route,
-                                               skip_label=True)
-
-                # Recolor back to BGR
-                image.flags.writeable = True
-                image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-
-                mp_drawing.draw_landmarks(
-                    image, results.pose_landmarks, mp_pose.POSE_CONNECTIONS,
-                    mp_drawing.DrawingSpec(
-                        color=(245,117,66), thickness=2, circle_radius=2),
-                    mp_drawing.DrawingSpec(
-                        color=(245,66,230), thickness=2, circle_radius=2))
-
-                left_thumb_point = None
-                right_thumb_point = None
-
-                # Extract landmarks
-                try:
-                    landmarks = results.pose_landmarks.landmark
-                    pose_landmark = mp_pose.PoseLandmark
-
-                    d = {}  # body dictionary
-
-                    # Upper body coordinates
-                    d["left_shoulder"] = \
-                        landmarks[pose_landmark.LEFT_SHOULDER.value]
-                    d["right_shoulder"] = \
-                        landmarks[pose_landmark.RIGHT_SHOULDER]
-
-                    d["left_elbow"] = landmarks[pose_landmark.LEFT_ELBOW.value]
-                    d["right_elbow"] = \
-                        landmarks[pose_landmark.RIGHT_ELBOW.value]
-
-                    frame_shape_0, frame_shape_1 = \
-                        frame.shape[0], frame.shape[1]
-
-                    # LEFT HAND
-                    d["left_pinky"] = landmarks[pose_landmark.LEFT_PINKY.value]
-                    d["left_index"] = landmarks[pose_landmark.LEFT_INDEX.value]
-                    d["left_thumb"] = landmarks[pose_landmark.LEFT_THUMB.value]
-                    d["left_wrist"] = landmarks[pose_landmark.LEFT_WRIST.value]
-                    left_hand_pts = hand_pts(d["left_pinky"], d["left_index"], 
-                                             d["left_thumb"], d["left_wrist"], 
-                                             frame_shape_1, frame_shape_0)
-
-                    # RIGHT HAND
-                    d["right_pinky"] = \
-                        landmarks[pose_landmark.RIGHT_PINKY.value]
-                    d["right_index"] = \
-                        landmarks[pose_landmark.RIGHT_INDEX.value]
-                    d["right_thumb"] = \
-                        landmarks[pose_landmark.RIGHT_THUMB.value]
-                    d["right_wrist"] = \
-                        landmarks[pose_landmark.RIGHT_WRIST.value]
-                    right_hand_pts = hand_pts(d["right_pinky"],
-                                              d["right_index"],
-                                              d["right_thumb"],
-                                              d["right_wrist"],
-                                              frame_shape_1, frame_shape_0)
-
-                    # Lower body coordinates
-                    d["left_knee"] = landmarks[pose_landmark.LEFT_KNEE.value]
-                    d["right_knee"] = landmarks[pose_landmark.RIGHT_KNEE.value]
-
-                    # LEFT FOOT
-                    d["left_ankle"] = landmarks[pose_landmark.LEFT_ANKLE.value]
-                    d["left_heel"] = landmarks[pose_landmark.LEFT_HEEL.value]
-                    d["left_foot_index"] = \
-                        landmarks[pose_landmark.LEFT_FOOT_INDEX.value]
-                    left_foot_pts = foot_pts(d["left_ankle"], d["left_heel"],
-                                             d["left_foot_index"],
-                                             frame_shape_1, frame_shape_0)
-
-                    # RIGHT FOOT
-                    d["right_ankle"] = \
-                        landmarks[pose_landmark.RIGHT_ANKLE.value]
-                    d["right_heel"] = landmarks[pose_landmark.RIGHT_HEEL.value]
-                    d["right_foot_index"] = \
-                        landmarks[pose_landmark.RIGHT_FOOT_INDEX.value]
-                    right_foot_pts = foot_pts(d["right_ankle"], d["right_heel"],
-                                              d["right_foot_index"],
-                                              frame_shape_1, frame_shape_0)
-                    
-                    right_thumb_point = get_center_point(d, "right_thumb",
-                                             right_foot_pts, left_foot_pts,
-                                             right_hand_pts, left_hand_pts)
-                    
-                    left_thumb_point = get_center_point(d, "left_thumb",
-                                             right_foot_pts, left_foot_pts,
-                                             right_hand_pts, left_hand_pts)
-
-
-                    # Display Coordinates
-                    # display_coords(d)
-
-                    extremities = [[right_hand_pts, left_hand_pts],
-                                   [right_foot_pts, left_foot_pts]]
-
-                    # for detection in detections:
-                    #     point = np.mean(extremities[HAND_FOOT][RIGHT_LEFT], 
-                    #                     axis=0)
-                    #     distance = get_relative_distance(point, detection)
-                    #     if frame_counter % 5 == 0:
-                    #         audio_queue.put(distance)
-                    #     print(f"Relative position: {distance} " + " " * 20, end='\r')
-                    if TARGET_HOLD is not None:
-                        point = np.mean(extremities[HAND_FOOT][RIGHT_LEFT], 
-                                        axis=0)
-                        distance = get_relative_distance(point, TARGET_HOLD)
-                        if frame_counter % 5 == 0:
-                            audio_queue.put(distance)
-                    
-
-                    # center_2d = np.mean(right_hand_pts, axis=0)[:2]
-
-                    cv2.fillPoly(image, [right_foot_pts], (245, 117, 66))
-                    cv2.fillPoly(image, [left_foot_pts], (245, 117, 66))
-
-                    display_hand(image,right_hand_pts)
-                    display_hand(image,left_hand_pts)
-
-                    # Calculate angle
-                    # angle = calculate_angle(shoulder, elbow, wrist)
-                    # Visualize angle
-                    # cv2.putText(image, str(angle),
-                    #                tuple(np.multiply(elbow, [640, 480]).astype(int)),
-                    #                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2, cv2.LINE_AA
-                    #                     )
-
-                except:
-                    pass
-
-                try:
-                    print("--------------------\n", end='\r')
-                    # print(RIGHT_LEFT, HAND_FOOT)
-
-                    global selected_limb
-
-                    limb = None
-
-                    # if selected_limb == 'right_hand':
-                    if RIGHT_LEFT == 0 and HAND_FOOT == 0:
-                        print("Right hand selected\n", end='\r')
-                        limb = right_thumb_point
-                    # elif selected_limb == 'left_hand':
-                    elif RIGHT_LEFT == 1 and HAND_FOOT == 0:
-                        print("Left hand selected\n", end='\r')
-                        limb = left_thumb_point
-                    elif RIGHT_LEFT == 0 and HAND_FOOT == 1:
-                        print("Right foot selected\n", end='\r')
-                        limb = left_thumb_point
-                    elif RIGHT_LEFT == 1 and HAND_FOOT == 1:
-                        print("Left foot selected\n", end='\r')
-                        limb = left_thumb_point
-
-                    # Find the closest hold that hasn't been grabbed yet
-                    next_target_hold = find_closest_hold(limb, 
-                                                        detections, 
-                                                        grabbed_areas)
-
-                    next_target_hold = list(next_target_hold)
-
-                    TARGET_HOLD = next_target_hold
-
-                    print(f"Next target hold: {next_target_hold}\n", end='\r')
-                    print(f"Grabbed areas: {grabbed_areas}\n", end='\r')
-
-                    distance_to_next_hold = get_relative_distance(
-                        limb, next_target_hold)
-                    print(f"Distance to next hold: {distance_to_next_hold} units\n", end='\r')
-
-                    if distance_to_next_hold < GRAB_THRESHOLD:
-                        threading.Thread(target=check_grab_hold, 
-                                 args=(limb, TARGET_HOLD, grabbed_areas, GRAB_THRESHOLD)).start()
-                        # print("Hold grabbed!\n", end='\r')
-
-                        # if not is_exact_detection_in_list(next_target_hold, 
-                        #                                 grabbed_areas):
-                        #     grabbed_areas.append(next_target_hold)
-                        #     # audio_feedback.calibrated_sound()
-
-                    print("--------------------\n", end='\r')
-
-                except Exception as exception:
-                    print(exception)
-
-                # print(results.pose_landmarks)
-                # Render detections
-                mp_drawing.draw_landmarks(
-                    image, results.pose_landmarks, mp_pose.POSE_CONNECTIONS,
-                    mp_drawing.DrawingSpec(
-                        color=(245,117,66), thickness=2, circle_radius=2),
-                    mp_drawing.DrawingSpec(
-                        color=(245,66,230), thickness=2, circle_radius=2))
-                
-                frame_counter = (frame_counter + 1) % 5
-
-                # mp_drawing.draw_landmarks(image, results.pose_landmarks, mp_pose.POSE_CONNECTIONS,
-                #                 mp_drawing.DrawingSpec(color=(245,117,66), thickness=2, circle_radius=2),
-                #                 mp_drawing.DrawingSpec(color=(245,66,230), thickness=2, circle_radius=2))
-
-            cv2.imshow('Pose Detection', image)
-
-            if cv2.waitKey(10) & 0xFF == ord('q'):
+            if display.wait_key(10) == ord('q'):
                 break
 
+        if calibrated:
+            track_climb(cap, pose, route, route_color, audio_queue,
+                        dwell_tracker, realtime=source.realtime,
+                        pose_roi=pose_roi, limb_smoother=limb_smoother,
+                        record_limbs=record_limbs, show=show)
+
+        print(f"Capture stats: {cap.stats()}")
         cap.release()
-        cv2.destroyAllWindows()
+        display.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Indoor Rock Climbing Assistance Tool")
+    parser.add_argument("--source", default="0",
+                        help="camera index, video file, image, folder or glob "
+                             "pattern (default: camera 0)")
+    parser.add_argument("--fast", action="store_true",
+                        help="replay recorded frames as fast as possible")
+    parser.add_argument("--loop", action="store_true",
+                        help="loop recorded videos and image folders")
+    parser.add_argument("--max-frames", type=int, default=None,
+                        help="stop after this many frames")
+    parser.add_argument("--recalibrate", action="store_true",
+                        help="ignore the cached hold map for this wall")
+    parser.add_argument("--dwell-time", type=float, default=3.0,
+                        help="seconds a limb must stay on a hold to grab it")
+    parser.add_argument("--grab-radius", type=float, default=100,
+                        help="pixels from a hold center that count as on it")
+    parser.add_argument("--backend", default=hold_model.backend,
+                        choices=hold_model.BACKENDS,
+                        help="inference backend of the hold detector")
+    parser.add_argument("--tiled", action="store_true",
+                        help="detect holds on overlapping full resolution tiles")
+    parser.add_argument("--tile-size", type=int, default=hold_model.TILE_SIZE,
+                        help="tile size in pixels for --tiled")
+    parser.add_argument("--pose-roi", action="store_true",
+                        help="run pose estimation on a crop that follows the "
+                             "climber instead of the full frame")
+    parser.add_argument("--predict-ms", type=float, default=None,
+                        help="predict limb positions this far ahead for the "
+                             "audio (default: the measured latency)")
+    parser.add_argument("--filter-min-cutoff", type=float, default=0.5,
+                        help="One-Euro cutoff (Hz) of a still limb, lower "
+                             "is smoother")
+    parser.add_argument("--filter-beta", type=float, default=0.05,
+                        help="One-Euro speed coefficient, higher lags less")
+    parser.add_argument("--headless", action="store_true",
+                        help="no windows, for wall units without a monitor")
+    parser.add_argument("--preview-port", type=int, default=None,
+                        help="serve an MJPEG preview on localhost:PORT")
+    parser.add_argument("--preview-fps", type=float, default=5,
+                        help="frame rate of the preview")
+    parser.add_argument("--route", default=None,
+                        choices=list(find_routes.colours.keys()),
+                        help="route colour to climb instead of asking "
+                             "(headless default: the coloured route with "
+                             "most holds)")
+    parser.add_argument("--speech", default=audio_input.engine,
+                        choices=audio_input.ENGINES,
+                        help="recognizer for limb commands (default: offline "
+                             "keyword spotting)")
+    parser.add_argument("--no-render", action="store_true",
+                        help="don't draw or show the tracking frames, only "
+                             "process them (stop with Ctrl+C)")
+    parser.add_argument("--record-limbs", default=None, metavar="NPZ",
+                        help="save the raw limb positions to replay with "
+                             "'benchmark.py filter'")
+    return parser.parse_args()
 
 def main():
+    args = parse_args()
+    hold_model.set_backend(args.backend)
+    if args.tiled:
+        hold_model.set_tiling(tile_size=args.tile_size)
+    if args.headless or args.preview_port is not None:
+        display.set_headless(args.headless, args.preview_port,
+                             args.preview_fps)
+    audio_input.set_engine(args.speech)
+    start_time = time.perf_counter()
+    source = frame_source.open_source(args.source, realtime=not args.fast,
+                                      loop=args.loop,
+                                      max_frames=args.max_frames)
+    print(f"Startup: imports {IMPORT_TIME:.1f}s, opening the source "
+          f"{time.perf_counter() - start_time:.1f}s, speech model loading in "
+          f"the background")
+
+    # The speech model loads while the wall is calibrated
+    audio_input.warmup()
+
     # Begin audio feedback thread
-    audio_queue = Queue()
+    audio_queue = pipeline.LatestValue()  # newest distance wins
     # detection_thread = threading.Thread(target=pose_est_hold_detect, 
     #                                     args=(audio_queue, ))
+    scheduler = audio_feedback.FeedbackScheduler(audio_queue)
     audio_feedback_thread = threading.Thread(target=audio_feedback_manager, 
-                                    args=(audio_queue, ), daemon=True)
+                                    args=(scheduler, ), daemon=True)
     audio_input_thread = threading.Thread(target=audio_input_manager,
                                           daemon=True)
 
@@ -502,13 +532,37 @@ def main():
     audio_feedback_thread.start()
     audio_input_thread.start()
 
-    listener = keyboard.Listener(on_press=on_press)
-    listener.start()
+    if args.headless:
+        # pynput needs a display, the limb is chosen by voice only
+        print("Headless: say the limb to guide, the keyboard isn't read.")
+    else:
+        try:
+            from pynput import keyboard
+        except ImportError as error:
+            print(f"Keyboard limb selection unavailable ({error}), say the "
+                  f"limb to guide instead.")
+        else:
+            listener = keyboard.Listener(on_press=on_press)
+            listener.start()
 
     # threading.Thread(target=pose_est_hold_detect, args=(audio_queue,)).start()
 
     # pose_est_hold_detect()
-    pose_est_hold_detect(audio_queue)
+    pose_est_hold_detect(audio_queue, source, use_cache=not args.recalibrate,
+                         dwell_time=args.dwell_time,
+                         grab_radius=args.grab_radius,
+                         pose_roi=args.pose_roi,
+                         limb_smoother=limb_filter.LimbFilter(
+                             args.filter_min_cutoff, args.filter_beta,
+                             predict_ms=args.predict_ms),
+                         record_limbs=args.record_limbs,
+                         show=not args.no_render and not (
+                             args.headless and args.preview_port is None),
+                         route_colour=args.route)
+
+    # Let the feedback thread finish and report
+    audio_queue.put(pipeline.STOP)
+    audio_feedback_thread.join(timeout=1.0)
 
 if "__main__" == __name__:
     main()
@@ -1,51 +1,102 @@
 import cv2
-from ultralytics import YOLO
+import numpy as np
 import supervision as sv
-from collections import Counter
 from sklearn.cluster import DBSCAN
-from multiprocessing import Pool
+from multiprocessing import Pool, shared_memory
+
+import display
+import hold_model
 detections = []
 test_image = 'test_images/test_3.jpg'
 
-def get_detections(frame):
-    model = YOLO('bestHuge.pt')
-    detections = sv.Detections.from_ultralytics(model(frame, verbose=False)[0])
-    detections = detections[detections.confidence > 0.5]
-    return detections
+def get_detections(frame, tiled=None):
+    # Shared model, weights are only loaded once per process
+    # tiled=True keeps the small holds of full resolution photos
+    return hold_model.detect_holds(frame, confidence=0.5, tiled=tiled)
 
-# rounding pixel coord to nearest 10th
-def round_pixel(pixel):
-    return (round(pixel[0], -1), round(pixel[1], -1), round(pixel[2], -1))
+# rounding pixel coord to nearest 10th, as a lookup table from channel value
+# to rounding step (0..26), same half-to-even rounding as round(x, -1)
+ROUND_LEVELS = (np.round(np.arange(256), -1) // 10).astype(np.int32)
+LEVEL_VALUES = np.minimum(np.arange(27) * 10, 255)  # 255 rounds to 260
 
 
-# def process_detection(detection):
-#     image = cv2.imread('test_1.jpg')
-#     detection_coordinates = detection[0]
-#     x1, y1, x2, y2 = map(int, detection_coordinates)
-#     temp = image[y1:y2, x1:x2, :]
+def dominant_colour(crop, background_threshold=0.5):
+    """Most common rounded BGR colour of <crop>, or the second most common
+    one if the first doesn't cover <background_threshold> of the crop"""
+    levels = ROUND_LEVELS[crop.reshape(-1, 3)]
+    # One integer key per rounded colour, 27 levels per channel
+    keys = levels[:, 0] * 729 + levels[:, 1] * 27 + levels[:, 2]
+    colours, first_seen, counts = np.unique(keys, return_index=True,
+                                            return_counts=True)
+    # Most common first, ties in order of appearance (like Counter)
+    order = np.lexsort((first_seen, -counts))
 
-#     lst = [round_pixel(pixel) for row in temp for pixel in row]
-#     c = Counter(lst)
-#     return c.most_common(1)[0][0]
+    # Check if the most common color is too close to the background count
+    best = order[0]
+    if counts[best] / len(keys) < background_threshold and len(order) > 1:
+        # Get the second most common color
+        best = order[1]
+    key = int(colours[best])
+    return tuple(int(LEVEL_VALUES[level])
+                 for level in (key // 729, key // 27 % 27, key % 27))
 
-def process_detection(detection, background_threshold=0.5):
-    image = cv2.imread(test_image)
-    detection_coordinates = detection[0]
-    x1, y1, x2, y2 = map(int, detection_coordinates)
-    temp = image[y1:y2, x1:x2, :]
 
-    lst = [round_pixel(pixel) for row in temp for pixel in row]
-    c = Counter(lst)
+def dominant_colours(image, detections, background_threshold=0.5):
+    """Dominant colour of every detection of a decoded BGR <image>"""
+    holds_by_colour = []
+    for x1, y1, x2, y2 in detections.xyxy.astype(int):
+        holds_by_colour.append(dominant_colour(image[y1:y2, x1:x2],
+                                               background_threshold))
+    return holds_by_colour
+
+
+# Process parallel version: the decoded image is copied once into shared
+# memory, workers attach to it without copying and get chunks of boxes
+_shared_image = None
+
+
+def _attach_shared_image(name, shape, dtype):
+    global _shared_image
+    memory = shared_memory.SharedMemory(name=name)
+    _shared_image = (memory, np.ndarray(shape, dtype=dtype, buffer=memory.buf))
+
+
+def _dominant_colours_chunk(args):
+    boxes, background_threshold = args
+    image = _shared_image[1]
+    return [dominant_colour(image[y1:y2, x1:x2], background_threshold)
+            for x1, y1, x2, y2 in boxes]
 
-    # Check if the most common color is too close to the background count
-    most_common, count = c.most_common(1)[0]
-    total_pixels = len(lst)
-    if count / total_pixels < background_threshold:
-        # Get the second most common color
-        second_most_common = c.most_common(2)[1][0]
-        return second_most_common
-    else:
-        return most_common
+
+def dominant_colours_parallel(image, detections, background_threshold=0.5,
+                              workers=None, chunk_size=32):
+    """dominant_colours() over a process pool sharing one copy of <image>
+
+    <workers>:      number of processes, None for one per CPU
+    <chunk_size>:   boxes sent to a worker per task
+    """
+    boxes = detections.xyxy.astype(int)
+    chunks = [(boxes[i:i + chunk_size], background_threshold)
+              for i in range(0, len(boxes), chunk_size)]
+
+    memory = shared_memory.SharedMemory(create=True, size=image.nbytes)
+    try:
+        np.ndarray(image.shape, dtype=image.dtype, buffer=memory.buf)[:] = image
+        with Pool(workers, initializer=_attach_shared_image,
+                  initargs=(memory.name, image.shape, image.dtype)) as pool:
+            results = pool.map(_dominant_colours_chunk, chunks)
+    finally:
+        memory.close()
+        memory.unlink()
+    return [colour for chunk in results for colour in chunk]
+
+
+def process_detection(detection, background_threshold=0.5, image=None):
+    if image is None:
+        image = cv2.imread(test_image)
+    detection_coordinates = detection[0]
+    x1, y1, x2, y2 = map(int, detection_coordinates)
+    return dominant_colour(image[y1:y2, x1:x2, :], background_threshold)
 
 
 def average_color(color_list):
@@ -66,6 +117,15 @@ def average_color(color_list):
     avg_b = total_b // len(color_list)
     return sv.Color(int(avg_r), int(avg_g), int(avg_b))
 
+def cluster_colours(holds_by_colour, eps=30):
+    """DBSCAN route label of every hold colour, -1 for noise"""
+    if len(holds_by_colour) == 0:
+        return np.empty(0, dtype=int)
+    # DBSCAN clustering
+    km = DBSCAN(eps=eps, algorithm='auto')
+    km.fit(holds_by_colour)
+    return km.labels_
+
 def visualize_detections(frame, detections, labels):
     image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
     image.flags.writeable = False
@@ -74,28 +134,33 @@ def visualize_detections(frame, detections, labels):
         detections = detections[[labels[i] == k for i in range(len(detections))]]
         frame = box_annotators[k].annotate(scene=image, detections=detections, skip_label=True)
 
-    cv2.imshow('Detections', frame)
-    cv2.waitKey()
+    display.show('Detections', frame)
+    display.wait_key(0)
     return detections
 
 
 if __name__ == "__main__":
-    frame = cv2.imread(test_image)
+    import argparse
+    parser = argparse.ArgumentParser(description="Group the holds of one photo into routes by colour")
+    parser.add_argument("image", nargs="?", default=test_image,
+                        help=f"wall photo (default: {test_image})")
+    parser.add_argument("--headless", action="store_true",
+                        help="no windows, for wall units without a monitor")
+    parser.add_argument("--preview-port", type=int, default=None,
+                        help="serve an MJPEG preview on localhost:PORT")
+    args = parser.parse_args()
+    if args.headless or args.preview_port is not None:
+        display.set_headless(args.headless, args.preview_port)
+
+    frame = cv2.imread(args.image)
     image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
     image.flags.writeable = False
     detections = get_detections(image)
 
-    with Pool() as pool:
-        holds_by_colour = list(pool.map(process_detection, detections)) # mutiprocessing , makes code run 10 secs faster
+    # One pass over the decoded image, no process pool needed
+    holds_by_colour = dominant_colours(frame, detections)
 
-    # DBSCAN parameters
-    eps = 30  # Adjust epsilon
-    algorithm = 'auto'  # Choose algorithm
-
-    # DBSCAN clustering
-    km = DBSCAN(eps=eps, algorithm=algorithm)
-    km.fit(holds_by_colour)
-    labels = km.labels_  # Your DBSCAN labels
+    labels = cluster_colours(holds_by_colour, eps=30)  # Your DBSCAN labels
     print("labels",labels)
     print(holds_by_colour)
 
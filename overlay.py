@@ -0,0 +1,59 @@
+# This file will be for:
+# 1. Drawing the selected route once into a cached overlay layer instead of
+#    re-annotating every frame
+# 2. Rebuilding that layer only when the route or its grabbed holds change
+# 3. Compositing the layer onto each frame in a single pass over its pixels
+
+
+import cv2
+import numpy as np
+
+GRABBED_COLOUR = (64, 64, 64)  # BGR, grabbed holds fade to dark grey
+
+
+class RouteOverlay:
+    """Cached drawing of a route_state.RouteState's hold boxes"""
+
+    def __init__(self, route, colour, thickness=3):
+        """
+        <route>:    route_state.RouteState to draw
+        <colour>:   BGR tuple of the route's boxes
+        """
+        self.route = route
+        self.colour = tuple(int(c) for c in colour)
+        self.thickness = thickness
+        self.indices = None  # flat byte indices of the drawn pixels
+        self.values = None   # their values
+        self._key = None
+        self.rebuilds = 0
+
+    def _build(self, shape):
+        layer = np.zeros(shape, dtype=np.uint8)
+        for box, grabbed in zip(self.route.xyxy.astype(int), self.route.grabbed):
+            cv2.rectangle(layer, tuple(box[:2]), tuple(box[2:]),
+                          GRABBED_COLOUR if grabbed else self.colour,
+                          self.thickness)
+        # Only the drawn pixels get composited, kept as flat byte indices
+        # (faster to scatter than whole pixels)
+        mask = np.zeros(shape[:2], dtype=np.uint8)
+        for box in self.route.xyxy.astype(int):
+            cv2.rectangle(mask, tuple(box[:2]), tuple(box[2:]), 255,
+                          self.thickness)
+        pixels = np.flatnonzero(mask)
+        self.indices = (pixels[:, None] * shape[2] + np.arange(shape[2])).ravel()
+        self.values = layer.reshape(-1)[self.indices]
+        self.rebuilds += 1
+
+    def apply(self, image):
+        """Draw the route on <image> in place, returns <image>"""
+        key = (image.shape, self.route.grabbed.tobytes())
+        if key != self._key:
+            self._build(image.shape)
+            self._key = key
+        if image.flags.c_contiguous:
+            image.reshape(-1)[self.indices] = self.values
+        else:  # a crop or view, reshape would copy
+            flat = image.flatten()
+            flat[self.indices] = self.values
+            image[...] = flat.reshape(image.shape)
+        return image
@@ -0,0 +1,257 @@
+# This file will be for:
+# 1. Running the climb tracking as stages (capture, pose, guidance, render)
+#    on their own threads so they overlap instead of running one by one
+# 2. Connecting the stages with bounded channels, optionally keeping only
+#    the latest item so a slow stage never works on stale frames
+# 3. Reporting each stage's throughput and queue depth
+# 4. A latest value channel for feedback that is only useful while fresh
+
+
+import threading
+import time
+from collections import deque
+
+STOP = object()  # end of stream marker, passed down through every stage
+
+
+class Channel:
+    """Bounded hand-off between two stages.
+
+    With latest=True a full channel drops its oldest item to make room (the
+    consumer always gets the freshest one), otherwise put() blocks until
+    there is room, so nothing is lost.
+    """
+
+    def __init__(self, maxsize=1, latest=True):
+        self.items = deque()
+        self.maxsize = maxsize
+        self.latest = latest
+        self.condition = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, item):
+        with self.condition:
+            if item is STOP:
+                # The end of the stream always gets through
+                self.closed = True
+                self.items.append(item)
+                self.condition.notify_all()
+                return
+            if self.latest:
+                while len(self.items) >= self.maxsize:
+                    self.items.popleft()
+                    self.dropped += 1
+            else:
+                self.condition.wait_for(
+                    lambda: len(self.items) < self.maxsize or self.closed)
+            self.items.append(item)
+            self.condition.notify_all()
+
+    def get(self, timeout=None):
+        """Next item, STOP at the end of the stream, None on timeout"""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.items, timeout=timeout):
+                return None
+            item = self.items.popleft()
+            self.condition.notify_all()
+            return item
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.items.clear()
+            self.items.append(STOP)
+            self.condition.notify_all()
+
+    def depth(self):
+        return sum(item is not STOP for item in self.items)
+
+
+class LatestValue(Channel):
+    """Single slot channel of timestamped values, for feedback that only
+    matters while it's fresh (e.g. the distance to the next hold).
+
+    A new value replaces one that wasn't taken yet, so the consumer always
+    acts on the newest. Keeps count of the replaced values and of how old
+    the taken ones were.
+    """
+
+    def __init__(self, window=100):
+        super().__init__(maxsize=1, latest=True)
+        self.received = 0
+        self.taken = 0
+        self.ages = deque(maxlen=window)  # seconds from timestamp to get()
+
+    def put(self, value, timestamp=None):
+        """<timestamp>: time.monotonic() the value was measured at, now if
+        None"""
+        if value is STOP:
+            super().put(STOP)
+            return
+        with self.condition:
+            self.received += 1
+        super().put((value, time.monotonic() if timestamp is None
+                     else timestamp))
+
+    def get(self, timeout=None):
+        """(value, timestamp) of the newest value, STOP at the end of the
+        stream, None on timeout"""
+        item = super().get(timeout)
+        if item is None or item is STOP:
+            return item
+        with self.condition:
+            self.taken += 1
+            self.ages.append(time.monotonic() - item[1])
+        return item
+
+    def stats(self):
+        ages = list(self.ages)
+        return {"received": self.received, "taken": self.taken,
+                "dropped": self.dropped,
+                "mean_age_ms": 1000 * sum(ages) / len(ages) if ages else 0.0,
+                "max_age_ms": 1000 * max(ages) if ages else 0.0}
+
+
+class StageStats:
+    """Throughput of one stage over the last <window> items"""
+
+    def __init__(self, window=30):
+        self.count = 0
+        self.finish_times = deque(maxlen=window)
+        self.busy_times = deque(maxlen=window)
+
+    def record(self, busy_time):
+        self.count += 1
+        self.finish_times.append(time.monotonic())
+        self.busy_times.append(busy_time)
+
+    def fps(self):
+        if len(self.finish_times) < 2:
+            return 0.0
+        span = self.finish_times[-1] - self.finish_times[0]
+        return (len(self.finish_times) - 1) / span if span > 0 else 0.0
+
+    def busy_ms(self):
+        if not self.busy_times:
+            return 0.0
+        return 1000 * sum(self.busy_times) / len(self.busy_times)
+
+
+class Stage:
+    """Runs <function> on every item of <inbox> and puts the result in
+    <outbox>.
+
+    A stage without an inbox is a source: <function> is called with no
+    arguments until it returns STOP. A function returning None skips the
+    item, so does one raising an exception (it's printed and counted). The
+    last stage can have no outbox.
+    """
+
+    def __init__(self, name, function, inbox=None, outbox=None):
+        self.name = name
+        self.function = function
+        self.inbox = inbox
+        self.outbox = outbox
+        self.stats = StageStats()
+        self.errors = 0  # items skipped because <function> raised
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name=self.name,
+                                       daemon=True)
+        self.thread.start()
+        return self
+
+    def step(self, timeout=None):
+        """Process one item, returns False once the stream has ended"""
+        start_time = time.perf_counter()
+        try:
+            if self.inbox is None:
+                result = self.function()
+            else:
+                item = self.inbox.get(timeout=timeout)
+                if item is None:
+                    return True  # timed out, nothing to do yet
+                if item is STOP:
+                    result = STOP
+                else:
+                    start_time = time.perf_counter()
+                    result = self.function(item)
+        except Exception as exception:
+            # One bad frame shouldn't stop the climber's guidance, skip it
+            self.errors += 1
+            print(f"{self.name} stage: skipped an item after "
+                  f"{type(exception).__name__}: {exception}")
+            return True
+
+        if result is STOP:
+            if self.outbox is not None:
+                self.outbox.put(STOP)
+            return False
+        self.stats.record(time.perf_counter() - start_time)
+        if result is not None and self.outbox is not None:
+            self.outbox.put(result)
+        return True
+
+    def run(self):
+        while self.running and self.step(timeout=0.1):
+            pass
+        self.running = False
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None and self.thread is not \
+                threading.current_thread():
+            self.thread.join(timeout=1.0)
+
+
+class Pipeline:
+    """A chain of stages. Every stage but the last runs on its own thread,
+    the last one is stepped by the caller (GUI work has to stay on the main
+    thread)."""
+
+    def __init__(self, stages, report_every=5.0):
+        self.stages = stages
+        self.report_every = report_every
+        self._last_report = time.monotonic()
+
+    def start(self):
+        for stage in self.stages[:-1]:
+            stage.start()
+        return self
+
+    def step(self, timeout=0.1):
+        """Run the last stage once and print a report when one is due"""
+        alive = self.stages[-1].step(timeout=timeout)
+        if self.report_every and \
+                time.monotonic() - self._last_report >= self.report_every:
+            self.report()
+        return alive
+
+    def stop(self):
+        for stage in self.stages:
+            stage.running = False
+            if stage.inbox is not None:
+                stage.inbox.close()
+        for stage in self.stages:
+            stage.stop()
+
+    def stats(self):
+        return {stage.name: {
+                    "fps": stage.stats.fps(),
+                    "busy_ms": stage.stats.busy_ms(),
+                    "processed": stage.stats.count,
+                    "queue": stage.inbox.depth() if stage.inbox else 0,
+                    "dropped": stage.inbox.dropped if stage.inbox else 0,
+                    "errors": stage.errors}
+                for stage in self.stages}
+
+    def report(self):
+        self._last_report = time.monotonic()
+        print("Pipeline: " + " | ".join(
+            f"{name} {s['fps']:5.1f} fps {s['busy_ms']:6.1f} ms "
+            f"q={s['queue']} drop={s['dropped']} err={s['errors']}"
+            for name, s in self.stats().items()))
@@ -0,0 +1,110 @@
+# This file will be for:
+# 1. Running MediaPipe Pose on a crop around the climber instead of the whole
+#    wall shot, the crop following the previous frame's landmarks
+# 2. Falling back to a downscaled full frame to find the climber again when
+#    tracking is lost
+# 3. Mapping the landmarks back to full frame coordinates
+
+
+import cv2
+import numpy as np
+
+import landmarks
+
+
+class RoiPoseTracker:
+    """MediaPipe Pose on a region of interest that follows the climber.
+
+    process() returns the same (33, 4) array landmarks.to_array() does, with
+    x and y normalised to the full frame, so callers can't tell which path
+    ran.
+    """
+
+    def __init__(self, pose, margin=0.3, max_size=480, search_width=640,
+                 min_visibility=0.5, min_landmarks=8):
+        """
+        <pose>:             mp_pose.Pose instance to run
+        <margin>:           crop margin around the landmarks, per side, as a
+                            fraction of their bounding box
+        <max_size>:         crops larger than this (px) are downscaled to it
+        <search_width>:     width of the downscaled frame used to re-acquire
+        <min_visibility>:   landmarks below this visibility don't count
+        <min_landmarks>:    fewer visible landmarks than this means lost
+        """
+        self.pose = pose
+        self.margin = margin
+        self.max_size = max_size
+        self.search_width = search_width
+        self.min_visibility = min_visibility
+        self.min_landmarks = min_landmarks
+        self.roi = None  # x1, y1, x2, y2 in full frame pixels, None when lost
+        self.stats = {"tracked": 0, "searched": 0, "lost": 0}
+
+    def process(self, image, out=None):
+        """(33, 4) landmarks of the RGB <image>, or None if nobody is found.
+
+        <out>:  preallocated float32 array to fill instead of a new one
+        """
+        height, width = image.shape[:2]
+        if self.roi is None:
+            # Lost: search the whole frame, downscaled
+            x1, y1, x2, y2 = 0, 0, width, height
+            scale = min(1.0, self.search_width / width)
+            self.stats["searched"] += 1
+        else:
+            x1, y1, x2, y2 = self.roi
+            scale = min(1.0, self.max_size / max(x2 - x1, y2 - y1))
+            self.stats["tracked"] += 1
+
+        crop = image[y1:y2, x1:x2]
+        if scale < 1.0:
+            crop = cv2.resize(crop, None, fx=scale, fy=scale,
+                              interpolation=cv2.INTER_AREA)
+        else:
+            crop = np.ascontiguousarray(crop)
+
+        results = self.pose.process(crop)
+        if results.pose_landmarks is None:
+            if self.roi is not None:
+                self.stats["lost"] += 1
+            self.roi = None
+            return None
+
+        pose_array = landmarks.to_array(results.pose_landmarks.landmark, out)
+        # Crop normalised -> full frame normalised. MediaPipe scales z like x.
+        crop_width, crop_height = x2 - x1, y2 - y1
+        pose_array[:, 0] = (pose_array[:, 0] * crop_width + x1) / width
+        pose_array[:, 1] = (pose_array[:, 1] * crop_height + y1) / height
+        pose_array[:, 2] *= crop_width / width
+
+        self.roi = self.next_roi(pose_array, width, height)
+        return pose_array
+
+    def next_roi(self, pose_array, width, height):
+        """Crop for the next frame around <pose_array>, None if too few
+        landmarks are visible to trust it"""
+        visible = pose_array[pose_array[:, 3] >= self.min_visibility, :2]
+        if len(visible) < self.min_landmarks:
+            if self.roi is not None:
+                self.stats["lost"] += 1
+            return None
+
+        points = visible * [width, height]
+        low, high = points.min(axis=0), points.max(axis=0)
+        # Square crop: MediaPipe letterboxes to a square input anyway
+        center = (low + high) / 2
+        half = (high - low).max() * (0.5 + self.margin)
+        half = max(half, self.max_size / 4)  # don't zoom in on a lone hand
+        x1, y1 = np.maximum(center - half, 0).astype(int)
+        x2, y2 = np.minimum(center + half, [width, height]).astype(int)
+
+        if self.roi is not None:
+            # Keep the old crop while it still covers the climber and isn't
+            # much bigger, so the crop (and MediaPipe's own tracking) stays
+            # steady from frame to frame
+            old_x1, old_y1, old_x2, old_y2 = self.roi
+            old_area = (old_x2 - old_x1) * (old_y2 - old_y1)
+            if old_x1 <= x1 and old_y1 <= y1 and x2 <= old_x2 and \
+                    y2 <= old_y2 and old_area <= 2 * (x2 - x1) * (y2 - y1):
+                return self.roi
+        return int(x1), int(y1), int(x2), int(y2)
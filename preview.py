@@ -0,0 +1,149 @@
+# This file will be for:
+# 1. Letting staff look at a headless wall unit from a browser
+# 2. Encoding a low rate JPEG preview on its own thread, so the climber's
+#    feedback loop never waits on it
+# 3. Serving it as an MJPEG stream on localhost
+#
+# Usage: python main.py --headless --preview-port 8080, then open
+#        http://localhost:8080/ in a browser
+
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+
+BOUNDARY = b"frame"
+
+
+class MjpegPreview:
+    """Low rate MJPEG preview of the latest frame.
+
+    submit() is called from the pipeline and only keeps a reference to the
+    frame when one is due, the resize and JPEG encode happen on the encoder
+    thread and the HTTP clients are served from the server's threads.
+    """
+
+    def __init__(self, port=8080, host='127.0.0.1', fps=5, quality=70,
+                 max_width=960):
+        """
+        <port>, <host>: where to serve, localhost only by default
+        <fps>:          preview frames per second at most
+        <quality>:      JPEG quality (0-100)
+        <max_width>:    frames wider than this are downscaled first
+        """
+        self.host = host
+        self.port = port
+        self.interval = 1.0 / fps
+        self.quality = quality
+        self.max_width = max_width
+
+        self.condition = threading.Condition()
+        self.pending = None   # frame waiting to be encoded
+        self.jpeg = None      # latest encoded frame
+        self.sequence = 0     # number of the latest encoded frame
+        self._last_submit = 0.0
+        self.running = False
+        self.encoder = None
+        self.server = None
+        self.stats = {"submitted": 0, "encoded": 0, "encode_ms": 0.0}
+
+    def start(self):
+        self.running = True
+        self.encoder = threading.Thread(target=self._encode_loop,
+                                        name="preview-encoder", daemon=True)
+        self.encoder.start()
+
+        preview = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                preview._stream(self)
+
+            def log_message(self, format, *args):
+                pass  # keep the console for the climber's feedback
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="preview-http",
+                         daemon=True).start()
+        print(f"Preview at http://{self.host}:{self.port}/")
+        return self
+
+    def submit(self, frame):
+        """Offer <frame> to the preview, ignored unless a frame is due.
+
+        The frame is copied, so the caller can keep drawing on it.
+        """
+        now = time.monotonic()
+        if not self.running or now - self._last_submit < self.interval:
+            return
+        self._last_submit = now
+        with self.condition:
+            self.pending = frame.copy()
+            self.stats["submitted"] += 1
+            self.condition.notify_all()
+
+    def _encode_loop(self):
+        while self.running:
+            with self.condition:
+                self.condition.wait_for(
+                    lambda: self.pending is not None or not self.running)
+                frame, self.pending = self.pending, None
+            if frame is None:
+                continue
+
+            start_time = time.perf_counter()
+            if frame.shape[1] > self.max_width:
+                scale = self.max_width / frame.shape[1]
+                frame = cv2.resize(frame, None, fx=scale, fy=scale,
+                                   interpolation=cv2.INTER_AREA)
+            ok, jpeg = cv2.imencode('.jpg', frame,
+                                    [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+            encode_time = time.perf_counter() - start_time
+            if not ok:
+                continue
+
+            with self.condition:
+                self.jpeg = jpeg.tobytes()
+                self.sequence += 1
+                self.stats["encoded"] += 1
+                self.stats["encode_ms"] += \
+                    (1000 * encode_time - self.stats["encode_ms"]) * 0.1
+                self.condition.notify_all()
+
+    def _stream(self, handler):
+        handler.send_response(200)
+        handler.send_header("Content-Type", "multipart/x-mixed-replace; "
+                            f"boundary={BOUNDARY.decode()}")
+        handler.send_header("Cache-Control", "no-cache")
+        handler.end_headers()
+
+        sent = 0
+        try:
+            while self.running:
+                with self.condition:
+                    if not self.condition.wait_for(
+                            lambda: self.sequence != sent or not self.running,
+                            timeout=1.0):
+                        continue
+                    jpeg, sent = self.jpeg, self.sequence
+                if jpeg is None:
+                    continue
+                handler.wfile.write(b"--" + BOUNDARY + b"\r\n"
+                                    b"Content-Type: image/jpeg\r\n"
+                                    + f"Content-Length: {len(jpeg)}\r\n\r\n".encode()
+                                    + jpeg + b"\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the browser went away
+
+    def stop(self):
+        self.running = False
+        with self.condition:
+            self.condition.notify_all()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.encoder is not None:
+            self.encoder.join(timeout=1.0)
@@ -0,0 +1,102 @@
+# This file will be for:
+# 1. Keeping the selected route as plain arrays (boxes, centers, grabbed mask)
+# 2. Finding the closest hold that hasn't been grabbed in one NumPy call
+
+
+import numpy as np
+
+
+class RouteState:
+    """The holds of the selected route as a structure of arrays.
+
+    xyxy:       (n, 4) float32 hold boxes
+    centers:    (n, 2) float32 hold centers, computed once
+    grabbed:    (n,) bool, True once the climber has grabbed the hold
+    """
+
+    def __init__(self, detections):
+        """
+        <detections>:   sv.Detections of the route, or an (n, 4) box array
+        """
+        xyxy = getattr(detections, 'xyxy', detections)
+        self.xyxy = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4)
+        self.centers = (self.xyxy[:, :2] + self.xyxy[:, 2:]) / 2
+        self.grabbed = np.zeros(len(self.xyxy), dtype=bool)
+
+    def __len__(self):
+        return len(self.xyxy)
+
+    def distances(self, point):
+        """Distance from <point> (x, y, ...) to the center of every hold"""
+        offsets = self.centers - np.asarray(point[:2], dtype=np.float32)
+        return np.sqrt(np.einsum('ij,ij->i', offsets, offsets))
+
+    def distance(self, point, index):
+        """Distance from <point> to the center of hold <index>"""
+        offset = self.centers[index] - np.asarray(point[:2], dtype=np.float32)
+        return float(np.hypot(offset[0], offset[1]))
+
+    def nearest_unvisited(self, point):
+        """Index of the closest hold not grabbed yet, or None if all are"""
+        if self.grabbed.all():
+            return None
+        distances = self.distances(point)
+        distances[self.grabbed] = np.inf
+        return int(np.argmin(distances))
+
+    def mark_grabbed(self, index):
+        self.grabbed[index] = True
+
+    def box(self, index):
+        return self.xyxy[index]
+
+
+class DwellTracker:
+    """Per-limb grab detection driven by frame timestamps.
+
+    The main loop calls update() once per frame with the limb's current
+    position. A hold counts as grabbed once the limb has stayed within
+    <radius> of it for <dwell_time> seconds of frames, no threads involved.
+    """
+
+    def __init__(self, dwell_time=3.0, radius=100, max_gap=0.5):
+        """
+        <dwell_time>:   seconds the limb has to stay on the hold
+        <radius>:       distance (px) from the hold center that counts as on it
+        <max_gap>:      seconds without an update before a dwell restarts
+        """
+        self.dwell_time = dwell_time
+        self.radius = radius
+        self.max_gap = max_gap
+        self.dwells = {}  # limb -> [hold index, start time, last update time]
+
+    def update(self, limb, point, hold_index, route, timestamp):
+        """Advance <limb>'s dwell on hold <hold_index> to <timestamp>.
+
+        Returns True on the frame the hold becomes grabbed, which also marks
+        it in <route>.
+        """
+        if hold_index is None or point is None or \
+                route.distance(point, hold_index) > self.radius:
+            self.dwells.pop(limb, None)
+            return False
+
+        dwell = self.dwells.get(limb)
+        if dwell is None or dwell[0] != hold_index or \
+                timestamp - dwell[2] > self.max_gap:
+            # New hold, or the limb wasn't tracked for a while
+            self.dwells[limb] = [hold_index, timestamp, timestamp]
+            return False
+
+        dwell[2] = timestamp
+        if timestamp - dwell[1] < self.dwell_time:
+            return False
+
+        route.mark_grabbed(hold_index)
+        del self.dwells[limb]
+        return True
+
+    def progress(self, limb, timestamp):
+        """Seconds <limb> has dwelled on its current hold so far"""
+        dwell = self.dwells.get(limb)
+        return 0.0 if dwell is None else timestamp - dwell[1]
@@ -0,0 +1,211 @@
+# This file will be for:
+# 1. Surveying every wall photo in a folder without a screen
+# 2. Detecting holds in batches and grouping them into routes by colour
+# 3. Writing one JSON route map per photo and reporting throughput
+#
+# Usage: python survey.py <photo folder> [--out survey] [--workers N]
+
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+import frame_source
+import hold_model
+import one_img
+
+
+def find_images(folder):
+    return [os.path.join(folder, name) for name in sorted(os.listdir(folder))
+            if name.lower().endswith(frame_source.IMAGE_EXTENSIONS)]
+
+
+def route_map(path, image, xyxy, confidence, eps=30):
+    """Group the holds of the decoded photo <image> into routes by their
+    dominant colour"""
+    holds_by_colour = [one_img.dominant_colour(image[y1:y2, x1:x2])
+                       for x1, y1, x2, y2 in xyxy.astype(int)]
+    labels = one_img.cluster_colours(holds_by_colour, eps=eps)
+
+    holds, routes = [], {}
+    for index, (box, score, colour, label) in enumerate(
+            zip(xyxy, confidence, holds_by_colour, labels)):
+        holds.append({"xyxy": [round(float(v), 1) for v in box],
+                      "confidence": round(float(score), 3),
+                      "colour_bgr": list(colour),
+                      "route": int(label)})
+        routes.setdefault(int(label), []).append(index)
+
+    return {
+        "image": path,
+        "width": image.shape[1],
+        "height": image.shape[0],
+        "holds": holds,
+        "routes": [{"route": label,
+                    "colour_bgr": np.mean([holds_by_colour[i] for i in indices],
+                                          axis=0).astype(int).tolist(),
+                    "holds": indices}
+                   for label, indices in sorted(routes.items())],
+    }
+
+
+def _shared_route_map(path, name, shape, dtype, xyxy, confidence, eps):
+    """route_map() in a worker process, on the photo the parent already
+    decoded into shared memory <name> (like one_img.dominant_colours_parallel)
+    so only the boxes are sent over"""
+    memory = shared_memory.SharedMemory(name=name)
+    try:
+        image = np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+        return route_map(path, image, xyxy, confidence, eps)
+    finally:
+        memory.close()
+
+
+def share_image(image):
+    """Copy of <image> in a new SharedMemory block, unlinked by the caller"""
+    memory = shared_memory.SharedMemory(create=True, size=image.nbytes)
+    np.ndarray(image.shape, dtype=image.dtype, buffer=memory.buf)[:] = image
+    return memory
+
+
+def _release(memory):
+    memory.close()
+    memory.unlink()
+
+
+def write_route_map(result, out_dir):
+    name = os.path.splitext(os.path.basename(result["image"]))[0] + '.json'
+    with open(os.path.join(out_dir, name), 'w') as file:
+        json.dump(result, file, indent=2)
+
+
+def failed_route_map(path, error):
+    """Route map of a photo that couldn't be surveyed"""
+    return {"image": path, "error": error, "holds": [], "routes": []}
+
+
+def survey(paths, out_dir, workers=None, batch_size=8, confidence=0.5, eps=30):
+    """Write a route map for every photo in <paths>, returns the timings
+    and the number of photos that failed"""
+    os.makedirs(out_dir, exist_ok=True)
+    model = hold_model.get_model()
+    timings = {"decode": 0.0, "detect": 0.0, "routes": 0.0, "failed": 0}
+    # Each photo in flight holds a decoded copy in shared memory, only let
+    # the route workers fall this far behind
+    max_pending = 2 * (workers or os.cpu_count() or 1)
+
+    def finish(path, future):
+        step_time = time.perf_counter()
+        try:
+            result = future.result()
+        except Exception as error:
+            result = failed_route_map(path, f"{type(error).__name__}: {error}")
+        timings["routes"] += time.perf_counter() - step_time
+        write_route_map(result, out_dir)
+        if "error" in result:
+            timings["failed"] += 1
+            print(f"{path}: failed, {result['error']}")
+        else:
+            print(f"{path}: {len(result['holds'])} holds, "
+                  f"{len(result['routes'])} routes")
+
+    start_time = time.perf_counter()
+    # spawn, forking a process that has loaded the model and started
+    # threads isn't safe
+    with ThreadPoolExecutor(workers) as decoders, \
+            ProcessPoolExecutor(workers,
+                                mp_context=multiprocessing.get_context("spawn")) \
+            as route_workers:
+        pending = []
+        for i in range(0, len(paths), batch_size):
+            batch_paths = paths[i:i + batch_size]
+
+            step_time = time.perf_counter()
+            frames = list(decoders.map(cv2.imread, batch_paths))
+            timings["decode"] += time.perf_counter() - step_time
+
+            # A corrupt or unreadable photo is recorded, not fatal
+            for path, frame in zip(batch_paths, frames):
+                if frame is None:
+                    timings["failed"] += 1
+                    write_route_map(failed_route_map(path, "could not be read"),
+                                    out_dir)
+                    print(f"{path}: failed, could not be read")
+            batch_paths = [path for path, frame in zip(batch_paths, frames)
+                           if frame is not None]
+            frames = [frame for frame in frames if frame is not None]
+            if not frames:
+                continue
+
+            step_time = time.perf_counter()
+            batch = hold_model.detect_holds_batch(frames, confidence, model)
+            timings["detect"] += time.perf_counter() - step_time
+
+            # Colours and clustering overlap with the next detection batch
+            for path, frame, detections in zip(batch_paths, frames, batch):
+                while len(pending) >= max_pending:
+                    finish(*pending.pop(0))
+                memory = share_image(frame)
+                future = route_workers.submit(
+                    _shared_route_map, path, memory.name, frame.shape,
+                    frame.dtype, detections.xyxy, detections.confidence, eps)
+                # Freed as soon as the worker is done with it
+                future.add_done_callback(
+                    lambda _, memory=memory: _release(memory))
+                pending.append((path, future))
+
+        for path, future in pending:
+            finish(path, future)
+
+    timings["total"] = time.perf_counter() - start_time
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Survey every wall photo in a folder")
+    parser.add_argument("folder", help="folder of wall photos")
+    parser.add_argument("--out", default="survey",
+                        help="folder for the JSON route maps (default: survey)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="decode and colour workers, default one per CPU")
+    parser.add_argument("--batch-size", type=int, default=8,
+                        help="photos per detection batch")
+    parser.add_argument("--confidence", type=float, default=0.5,
+                        help="detection confidence threshold")
+    parser.add_argument("--eps", type=float, default=30,
+                        help="DBSCAN colour distance for one route")
+    parser.add_argument("--backend", default=hold_model.backend,
+                        choices=hold_model.BACKENDS,
+                        help="inference backend of the hold detector")
+    parser.add_argument("--tiled", action="store_true",
+                        help="detect holds on overlapping full resolution tiles")
+    args = parser.parse_args()
+
+    hold_model.set_backend(args.backend)
+    if args.tiled:
+        hold_model.set_tiling()
+
+    paths = find_images(args.folder)
+    if not paths:
+        print(f"No photos found in {args.folder}")
+        return
+    timings = survey(paths, args.out, args.workers, args.batch_size,
+                     args.confidence, args.eps)
+
+    print(f"Surveyed {len(paths)} photos in {timings['total']:.1f}s "
+          f"({len(paths) / timings['total']:.2f} images/sec)")
+    print(f"  decode {timings['decode']:.1f}s, detect {timings['detect']:.1f}s, "
+          f"waiting on route workers {timings['routes']:.1f}s")
+    if timings["failed"]:
+        print(f"  {timings['failed']} photos failed, see the \"error\" of "
+              f"their route maps in {args.out}")
+
+if "__main__" == __name__:
+    main()